@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import hmac
+import os
+import flask
+from datastore import studies, submissions
+
+# Admin routes are served to clients presenting RTFMRI_ADMIN_TOKEN in an
+# X-Admin-Token header (or as an "Authorization: Bearer" token, as Prometheus
+# sends it). Without a token they are only served by the debug server, to
+# localhost: behind a reverse proxy every request would come from there
+admin_token = os.environ.get('RTFMRI_ADMIN_TOKEN')
+
+blueprint = flask.Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@blueprint.before_request
+def check_access():
+    if admin_token:
+        token = flask.request.headers.get('X-Admin-Token', '')
+        authorization = flask.request.headers.get('Authorization', '')
+        if not token and authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+        if not hmac.compare_digest(token, admin_token):
+            flask.abort(403)
+    elif not flask.current_app.debug or flask.request.remote_addr not in ('127.0.0.1', '::1') \
+            or 'X-Forwarded-For' in flask.request.headers or 'Forwarded' in flask.request.headers:
+        flask.abort(403)
+
+
+@blueprint.route('/version')
+def version():
+    data = studies.get()
+    return flask.jsonify(version=data.version, studies=len(data))
+
+
+@blueprint.route('/reload', methods=['POST'])
+def reload():
+    # Loads the new snapshot in this worker before answering; the other
+    # workers swap theirs in when their watcher sees the reload request
+    old = studies.get().version
+    data = studies.request_reload()
+    return flask.jsonify(previous=old, version=data.version, studies=len(data))
+
+
+@blueprint.route('/submissions/<int:submission_id>', methods=['DELETE'])
+def withdraw(submission_id):
+    # The study's values are subtracted from the counts (see studies.with_submissions)
+    if not submissions.delete(submission_id):
+        flask.abort(404)
+    data = studies.refresh()
+    return flask.jsonify(withdrawn=submission_id, version=data.version, studies=len(data))
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Per-callback call counts, latency, serialisation time and response size.
+
+`instrument(app)` (called from app.py unless RTFMRI_METRICS=0) wraps every
+callback registered afterwards twice: around the callback function itself,
+and around Dash's wrapper, which also serialises the response to JSON. The
+difference between the two is the serialisation time, and the wrapper's
+return value gives the response size. Measurements are kept per callback
+output id, e.g. `..table.data...table.page_count..`, and served at
+
+    /metrics        Prometheus text format
+    /metrics.json   the same as a JSON summary
+
+to the same clients as the admin routes (see api/admin.py). Each gunicorn
+worker keeps its own counts. With RTFMRI_METRICS=0 nothing is wrapped and
+the routes do not exist.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+import flask
+from dash.exceptions import PreventUpdate
+from api import admin
+
+enabled = os.environ.get('RTFMRI_METRICS', '1') != '0'
+
+# Upper bounds of the histogram buckets (the Prometheus client defaults for latency)
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+size_buckets = (1e3, 1e4, 1e5, 1e6, 1e7)
+
+
+class CallbackMetrics(object):
+    """Thread-safe counters and histograms, per callback output id."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outputs = {}
+
+    def observe(self, output, status, seconds, serialization_seconds=0., size=0):
+        with self.lock:
+            series = self.outputs.get(output)
+            if series is None:
+                series = self.outputs[output] = {
+                    'calls': {},
+                    'latency_buckets': [0] * (len(latency_buckets) + 1),
+                    'latency_seconds': 0.,
+                    'latency_max_seconds': 0.,
+                    'serialization_seconds': 0.,
+                    'size_buckets': [0] * (len(size_buckets) + 1),
+                    'response_bytes': 0,
+                    'response_max_bytes': 0,
+                }
+            series['calls'][status] = series['calls'].get(status, 0) + 1
+            series['latency_buckets'][bisect.bisect_left(latency_buckets, seconds)] += 1
+            series['latency_seconds'] += seconds
+            series['latency_max_seconds'] = max(series['latency_max_seconds'], seconds)
+            if status == 'ok':
+                series['serialization_seconds'] += serialization_seconds
+                series['size_buckets'][bisect.bisect_left(size_buckets, size)] += 1
+                series['response_bytes'] += size
+                series['response_max_bytes'] = max(series['response_max_bytes'], size)
+
+    def summary(self):
+        """Per-output totals and means, as JSON-serialisable dicts."""
+        with self.lock:
+            summary = {}
+            for output, series in self.outputs.items():
+                calls = sum(series['calls'].values())
+                ok = series['calls'].get('ok', 0)
+                summary[output] = {
+                    'calls': dict(series['calls']),
+                    'latency_mean_ms': 1000 * series['latency_seconds'] / calls,
+                    'latency_max_ms': 1000 * series['latency_max_seconds'],
+                    # [upper bound in seconds, calls] per bucket, the last one unbounded
+                    'latency_histogram': [list(pair) for pair in zip(list(latency_buckets) + ['+Inf'],
+                                                                     series['latency_buckets'])],
+                    'serialization_mean_ms': 1000 * series['serialization_seconds'] / ok if ok else 0.,
+                    'response_mean_bytes': series['response_bytes'] / ok if ok else 0.,
+                    'response_max_bytes': series['response_max_bytes'],
+                }
+            return summary
+
+    def prometheus(self):
+        """All series in the Prometheus text exposition format."""
+        with self.lock:
+            outputs = sorted(self.outputs.items())
+            lines = []
+
+            def header(name, kind, text):
+                lines.append('# HELP {} {}'.format(name, text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+            def histogram(name, output, bounds, counts, total):
+                cumulative = 0
+                for bound, count in zip([repr(float(b)) for b in bounds] + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{output="{}",le="{}"}} {}'.format(name, output, bound, cumulative))
+                lines.append('{}_sum{{output="{}"}} {}'.format(name, output, total))
+                lines.append('{}_count{{output="{}"}} {}'.format(name, output, cumulative))
+
+            header('dash_callback_calls_total', 'counter', 'Callback calls by outcome (ok, prevented, error).')
+            for output, series in outputs:
+                for status, count in sorted(series['calls'].items()):
+                    lines.append('dash_callback_calls_total{{output="{}",status="{}"}} {}'.format(
+                        _label(output), status, count))
+            header('dash_callback_duration_seconds', 'histogram', 'Callback latency, including serialisation.')
+            for output, series in outputs:
+                histogram('dash_callback_duration_seconds', _label(output), latency_buckets,
+                          series['latency_buckets'], series['latency_seconds'])
+            header('dash_callback_serialization_seconds_total', 'counter', 'Time spent serialising responses.')
+            for output, series in outputs:
+                lines.append('dash_callback_serialization_seconds_total{{output="{}"}} {}'.format(
+                    _label(output), series['serialization_seconds']))
+            header('dash_callback_response_bytes', 'histogram', 'Size of the JSON responses.')
+            for output, series in outputs:
+                histogram('dash_callback_response_bytes', _label(output), size_buckets,
+                          series['size_buckets'], series['response_bytes'])
+            return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.outputs.clear()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = CallbackMetrics()
+_local = threading.local()
+
+
+def _timed(func):
+    # Innermost: the time spent in the callback function itself
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.seconds = time.perf_counter() - start
+    return timed
+
+
+def _observed(output, callback):
+    # Outermost: Dash's wrapper, i.e. the callback plus serialisation
+    @functools.wraps(callback)
+    def observed(*args, **kwargs):
+        _local.seconds = None
+        start = time.perf_counter()
+        try:
+            response = callback(*args, **kwargs)
+        except PreventUpdate:
+            metrics.observe(output, 'prevented', time.perf_counter() - start)
+            raise
+        except Exception:
+            metrics.observe(output, 'error', time.perf_counter() - start)
+            raise
+        seconds = time.perf_counter() - start
+        inner = _local.seconds if _local.seconds is not None else seconds
+        metrics.observe(output, 'ok', seconds, seconds - inner, len(response))
+        return response
+    return observed
+
+
+def wrap_callbacks(app, outer, inner=None):
+    """Wrap every callback registered on `app` from now on.
+
+    `outer(output, callback)` wraps Dash's wrapper of the callback (the
+    function Dash dispatches to, which serialises the response) and
+    `inner(func)`, if given, the callback function itself.
+    """
+    register_callback = app.callback
+
+    def callback(output, inputs=[], state=[]):
+        register = register_callback(output, inputs, state)
+        # Dash adds the callback's entry last, once it has been validated
+        key = list(app.callback_map)[-1]
+
+        def decorator(func):
+            wrapped = register(inner(func) if inner else func)
+            app.callback_map[key]['callback'] = outer(key, app.callback_map[key]['callback'])
+            return wrapped
+        return decorator
+
+    app.callback = callback
+
+
+def instrument(app):
+    """Measure every callback registered on `app` from now on."""
+    wrap_callbacks(app, _observed, _timed)
+    app.server.register_blueprint(blueprint)
+
+
+blueprint = flask.Blueprint('metrics', __name__)
+blueprint.before_request(admin.check_access)
+
+
+@blueprint.route('/metrics')
+def prometheus():
+    return flask.Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@blueprint.route('/metrics.json')
+def summary():
+    return flask.jsonify(metrics.summary())
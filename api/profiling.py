@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Profiles of slow callbacks, captured in production when switched on.
+
+Set RTFMRI_PROFILE_SLOW_MS to a latency threshold in milliseconds to turn
+this on. Every callback is then profiled while it runs, and the profile is
+kept when the callback took longer than the threshold:
+
+- RTFMRI_PROFILE_MODE=sample (the default): a background thread records the
+  stack of each running callback every RTFMRI_PROFILE_INTERVAL_MS (default
+  5) milliseconds. This costs little, and the result is a collapsed-stack
+  file ("frame;frame;... count" lines) for flame graph tools such as
+  speedscope or flamegraph.pl.
+- RTFMRI_PROFILE_MODE=cprofile: cProfile traces every call. This is exact but
+  slows callbacks down noticeably. The result is a pstats file, for
+  `python -m pstats` or snakeviz.
+
+The last RTFMRI_PROFILE_KEEP (default 20) profiles are kept in memory, per
+process, and served to the same clients as the admin routes:
+
+    /admin/profiles              list of the kept profiles, newest first
+    /admin/profiles/<id>         download one
+    /admin/profiles/<id>/text    the top of a profile, as text
+"""
+import collections
+import cProfile
+import datetime
+import functools
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import flask
+from dash.exceptions import PreventUpdate
+from api import admin, metrics
+
+slow_ms = float(os.environ.get('RTFMRI_PROFILE_SLOW_MS') or 0)
+enabled = slow_ms > 0
+mode = os.environ.get('RTFMRI_PROFILE_MODE', 'sample')
+interval_ms = float(os.environ.get('RTFMRI_PROFILE_INTERVAL_MS', '5'))
+keep = int(os.environ.get('RTFMRI_PROFILE_KEEP', '20'))
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+profiles = collections.deque(maxlen=keep)
+_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(root_dir + os.sep):
+        path = os.path.relpath(path, root_dir)
+    return '{} ({}:{})'.format(code.co_name, path, frame.f_lineno)
+
+
+class Sampler(object):
+    """Records the stacks of registered threads at a fixed interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, counts in self.stacks.items():
+                    frame = frames.get(ident)
+                    names = []
+                    while frame is not None:
+                        names.append(_frame_name(frame))
+                        frame = frame.f_back
+                    if names:
+                        counts[';'.join(reversed(names))] += 1
+
+    def start(self, ident):
+        """Start recording the stack of thread `ident`."""
+        with self.lock:
+            # Threads do not survive a fork; start one per process
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self._run, name='callback-profiler')
+                thread.daemon = True
+                thread.start()
+            self.stacks[ident] = collections.Counter()
+
+    def stop(self, ident):
+        """Stop recording thread `ident`; returns its stack counts."""
+        with self.lock:
+            return self.stacks.pop(ident)
+
+
+sampler = Sampler(interval_ms / 1000.)
+
+
+def _store(output, status, seconds, data, extension, summary):
+    with _lock:
+        profiles.appendleft({
+            'id': next(_ids),
+            'output': output,
+            'status': status,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'ms': 1000 * seconds,
+            'mode': mode,
+            'extension': extension,
+            'data': data,
+            'summary': summary,
+        })
+
+
+def _sampled(output, callback):
+    @functools.wraps(callback)
+    def profiled(*args, **kwargs):
+        ident = threading.get_ident()
+        sampler.start(ident)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = callback(*args, **kwargs)
+            status = 'ok'
+            return response
+        except PreventUpdate:
+            status = 'prevented'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            counts = sampler.stop(ident)
+            if seconds * 1000 >= slow_ms:
+                lines = ['{} {}'.format(stack, count) for stack, count in counts.most_common()]
+                _store(output, status, seconds, '\n'.join(lines) + '\n', 'txt', _summary_samples(counts))
+    return profiled
+
+
+def _summary_samples(counts, limit=25):
+    # Samples per innermost frame, i.e. where the time was spent
+    total = sum(counts.values())
+    own = collections.Counter()
+    for stack, count in counts.items():
+        own[stack.rsplit(';', 1)[-1]] += count
+    lines = ['{} samples'.format(total)]
+    lines.extend('{:6.1%}  {}'.format(count / total, name) for name, count in own.most_common(limit))
+    return '\n'.join(lines) + '\n'
+
+
+def _cprofiled(output, callback):
+    @functools.wraps(callback)
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running in this thread
+            return callback(*args, **kwargs)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = callback(*args, **kwargs)
+            status = 'ok'
+            return response
+        except PreventUpdate:
+            status = 'prevented'
+            raise
+        finally:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            if seconds * 1000 >= slow_ms:
+                text = io.StringIO()
+                stats = pstats.Stats(profile, stream=text)
+                stats.sort_stats('cumulative').print_stats(25)
+                # The format of Stats.dump_stats
+                _store(output, status, seconds, marshal.dumps(stats.stats), 'pstats', text.getvalue())
+    return profiled
+
+
+def instrument(app):
+    """Profile every callback registered on `app` from now on."""
+    metrics.wrap_callbacks(app, _cprofiled if mode == 'cprofile' else _sampled)
+    app.server.register_blueprint(blueprint)
+
+
+blueprint = flask.Blueprint('profiles', __name__, url_prefix='/admin/profiles')
+blueprint.before_request(admin.check_access)
+
+
+def _find(profile_id):
+    with _lock:
+        for profile in profiles:
+            if profile['id'] == profile_id:
+                return profile
+    flask.abort(404)
+
+
+@blueprint.route('')
+def index():
+    with _lock:
+        listing = [{key: value for key, value in profile.items() if key not in ('data', 'summary')}
+                   for profile in profiles]
+    for profile in listing:
+        profile['url'] = flask.url_for('.download', profile_id=profile['id'])
+    return flask.jsonify(threshold_ms=slow_ms, mode=mode, profiles=listing)
+
+
+@blueprint.route('/<int:profile_id>')
+def download(profile_id):
+    profile = _find(profile_id)
+    data = profile['data']
+    response = flask.Response(data, mimetype='application/octet-stream' if isinstance(data, bytes) else 'text/plain')
+    response.headers['Content-Disposition'] = 'attachment; filename=callback-{}.{}'.format(
+        profile_id, profile['extension'])
+    return response
+
+
+@blueprint.route('/<int:profile_id>/text')
+def text(profile_id):
+    profile = _find(profile_id)
+    return flask.Response('{} took {:.0f} ms ({})\n\n{}'.format(
+        profile['output'], profile['ms'], profile['status'], profile['summary']), mimetype='text/plain')
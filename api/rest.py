@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""Read-only JSON/CSV API for scripts and notebooks, outside the Dash callbacks.
+
+    /api/studies                          the study table
+    /api/counts                           counts per value of every feature
+    /api/crosstab/<feature1>/<feature2>   counts per pair of values
+    /api/studies/export                   a selection of studies, streamed
+
+Query parameters:
+
+- format=json (default) or csv, or an Accept: text/csv header
+- fields=author,vendor,year: only these columns (studies; also the derived
+  columns year and first_author) or features (counts)
+- q=vendor=Siemens AND mc=Y: only studies matching a query (studies; see
+  datastore.query), search=term: only studies containing a search term
+
+Every response has a strong ETag derived from the data version, the path,
+the parameters and the encoding, and is answered with 304 Not Modified when
+it matches If-None-Match, so polling clients only download data that
+changed. Responses are gzipped for clients that accept it.
+
+The study table and exports are written in chunks of `export_chunk_rows`
+studies as they are sent, so memory use does not grow with the selection;
+only the small counts and crosstab bodies are memoized. Exports take format=csv
+(default), jsonl (JSON Lines) or parquet (with pyarrow), `fields`, and the
+selections of the pages: search= (the Browse search box, a query or a
+search term), filter= (a Browse table filter_query), sort=author,-year,
+feature= and value= (a bar clicked on Visualize) and q= (a query).
+"""
+import csv
+import hashlib
+import io
+import json
+import urllib.parse
+import zlib
+import flask
+import numpy as np
+from datastore import query, studies, tablequery
+from datastore.memo import memoize
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+blueprint = flask.Blueprint('rest', __name__, url_prefix='/api')
+
+mimetypes = {'json': 'application/json', 'csv': 'text/csv'}
+export_mimetypes = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+# Columns computed at load time that can be requested besides the study table's
+derived_fields = ['year', 'first_author']
+
+# Studies per chunk of a streamed export
+export_chunk_rows = 10000
+
+# Export formats available here, with their names for download links
+export_formats = {'csv': 'CSV', 'jsonl': 'JSON Lines'}
+if pyarrow is not None:
+    export_formats['parquet'] = 'Parquet'
+
+
+@blueprint.errorhandler(400)
+def bad_request(error):
+    return flask.jsonify(error=error.description), 400
+
+
+def _format():
+    fmt = flask.request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if flask.request.accept_mimetypes.best_match(['application/json', 'text/csv']) == 'text/csv' \
+            else 'json'
+    if fmt not in mimetypes:
+        flask.abort(400, 'Unknown format {!r}, use json or csv'.format(fmt))
+    return fmt
+
+
+def _fields(allowed, default):
+    fields = flask.request.args.get('fields')
+    if not fields:
+        return tuple(default)
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        flask.abort(400, 'Unknown fields: {}'.format(', '.join(unknown)))
+    return fields
+
+
+def _csv(rows):
+    text = io.StringIO()
+    csv.writer(text, lineterminator='\n').writerows(rows)
+    return text.getvalue()
+
+
+def _respond(data, build, *args):
+    """Response with the output of `build(data, fmt, *args)`, or a 304.
+
+    `build` returns the body as a string, or as an iterable of strings to
+    be streamed.
+    """
+    fmt = _format()
+    gzipped = 'gzip' in flask.request.accept_encodings
+    params = sorted((key, value) for key, value in flask.request.args.items(multi=True) if key != 'format')
+    digest = hashlib.sha1(json.dumps([data.version, flask.request.path, params, fmt]).encode()).hexdigest()
+    # Strong ETags identify the bytes sent, so the gzipped body gets its own
+    etag = digest[:20] + ('-gzip' if gzipped else '')
+
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        body = build(data, fmt, *args)
+        if isinstance(body, str):
+            body = b''.join(_encode([body], gzipped))
+        else:
+            body = _encode(body, gzipped)
+        response = flask.Response(body, mimetype=mimetypes[fmt])
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+
+def _encode(chunks, gzipped):
+    # UTF-8 bytes of the chunks, compressed as one gzip stream if asked
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzipped else None
+    for chunk in chunks:
+        chunk = chunk.encode('utf-8')
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def _frame(data, fields, rows):
+    """Columns `fields` of the studies at positions `rows` (or a slice)."""
+    derived = data.derived.iloc[rows]
+    frame = data.df.iloc[rows].assign(year=derived['year'].astype('Int64'), first_author=derived['first_author'])
+    return frame[list(fields)]
+
+
+def _query_mask(data, query_text):
+    try:
+        return query.mask(data, query_text)
+    except query.QueryError as e:
+        flask.abort(400, 'Invalid query: {}'.format(e))
+
+
+def _studies(data, fmt, fields, rows):
+    if fmt == 'csv':
+        yield from _export_chunks(data, rows, fields, 'csv')
+        return
+    yield '{{"version": {}, "count": {}, "studies": ['.format(json.dumps(data.version), len(rows))
+    separator = ''
+    for frame in _chunked_frames(data, rows, fields):
+        yield separator + frame.to_json(orient='records')[1:-1]
+        separator = ','
+    yield ']}'
+
+
+@blueprint.route('/studies')
+def study_table():
+    data = studies.get()
+    fields = _fields(list(data.df.columns) + derived_fields, data.df.columns)
+    term, query_text = flask.request.args.get('search', ''), flask.request.args.get('q', '')
+    # Selected before answering, so that an invalid query gets a 400
+    if query_text or term:
+        mask = _query_mask(data, query_text) if query_text else data.search(term)
+        if query_text and term:
+            mask &= data.search(term)
+        rows = np.flatnonzero(mask)
+    else:
+        rows = np.arange(len(data))
+    return _respond(data, _studies, fields, rows)
+
+
+def _export_rows(data, args):
+    # Positions of the selected studies, in the requested order
+    mask = tablequery.search_mask(data, args.get('search', ''))
+    mask = tablequery.filter_mask(data, args.get('filter', ''), mask)
+    if args.get('q'):
+        mask &= _query_mask(data, args['q'])
+    if args.get('feature'):
+        if args['feature'] not in data.coded:
+            flask.abort(400, 'Unknown feature {!r}'.format(args['feature']))
+        mask &= query.mask(data, query.equals(args['feature'], args.get('value', '')))
+    sort_by = []
+    for key in args.get('sort', '').split(','):
+        key = key.strip()
+        if key:
+            column = key.lstrip('-')
+            if column not in data.df.columns:
+                flask.abort(400, 'Cannot sort by {!r}'.format(column))
+            sort_by.append({'column_id': column, 'direction': 'desc' if key.startswith('-') else 'asc'})
+    return tablequery.sort_rows(data, np.flatnonzero(mask), sort_by)
+
+
+class _Sink(io.RawIOBase):
+    # File for the parquet writer, emptied after each row group
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, chunk):
+        self.chunks.append(bytes(chunk))
+        return len(chunk)
+
+    def take(self):
+        chunk = b''.join(self.chunks)
+        self.chunks = []
+        return chunk
+
+
+def _chunked_frames(data, rows, fields):
+    # Columns `fields` of the studies at positions `rows`, export_chunk_rows at a time
+    for start in range(0, len(rows), export_chunk_rows):
+        yield _frame(data, fields, rows[start:start + export_chunk_rows])
+
+
+def _export_chunks(data, rows, fields, fmt):
+    chunks = _chunked_frames(data, rows, fields)
+    if fmt == 'csv':
+        yield _frame(data, fields, rows[:0]).to_csv(index=False)
+        for frame in chunks:
+            yield frame.to_csv(index=False, header=False)
+    elif fmt == 'jsonl':
+        for frame in chunks:
+            yield frame.to_json(orient='records', lines=True).rstrip('\n') + '\n'
+    else:
+        sink = _Sink()
+        schema = pyarrow.Table.from_pandas(_frame(data, fields, rows[:0]), preserve_index=False).schema
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        for frame in chunks:
+            writer.write_table(pyarrow.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            yield sink.take()
+        writer.close()
+        yield sink.take()
+
+
+def export_url(fmt, **params):
+    """URL of an export of the studies selected by `params` (empty ones left out)."""
+    params = {key: value for key, value in params.items() if value}
+    params['format'] = fmt
+    return blueprint.url_prefix + '/studies/export?' + urllib.parse.urlencode(params)
+
+
+@blueprint.route('/studies/export')
+def export():
+    data = studies.get()
+    fmt = flask.request.args.get('format', 'csv')
+    if fmt not in export_formats:
+        flask.abort(400, 'Unknown format {!r}, use {}'.format(fmt, ', '.join(export_formats)))
+    fields = _fields(list(data.df.columns) + derived_fields, data.df.columns)
+    rows = _export_rows(data, flask.request.args)
+    response = flask.Response(_export_chunks(data, rows, fields, fmt), mimetype=export_mimetypes[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename=studies.{}'.format(fmt)
+    return response
+
+
+@memoize(maxsize=64)
+def _counts(data, fmt, features):
+    counts = {feature: data.cube.value_counts(feature) for feature in features}
+    if fmt == 'csv':
+        rows = [['feature', 'value', 'count']]
+        for feature in features:
+            rows.extend([feature, value, int(count)] for value, count in counts[feature].items())
+        return _csv(rows)
+    return json.dumps({'version': data.version, 'counts': {
+        feature: {value: int(count) for value, count in counts[feature].items()} for feature in features}})
+
+
+@blueprint.route('/counts')
+def counts():
+    data = studies.get()
+    return _respond(data, _counts, _fields(data.cube.features, data.cube.features))
+
+
+@memoize(maxsize=64)
+def _crosstab(data, fmt, feature1, feature2):
+    labels1, labels2 = list(data.cube.labels[feature1]), list(data.cube.labels[feature2])
+    table = data.cube.table(feature1, feature2).tolist()
+    if fmt == 'csv':
+        return _csv([[feature1 + '/' + feature2] + labels2] + [[label] + row for label, row in zip(labels1, table)])
+    return json.dumps({'version': data.version, 'feature1': feature1, 'feature2': feature2,
+                       'counts': {label: dict(zip(labels2, row)) for label, row in zip(labels1, table)}})
+
+
+@blueprint.route('/crosstab/<feature1>/<feature2>')
+def crosstab(feature1, feature2):
+    data = studies.get()
+    for feature in (feature1, feature2):
+        if feature not in data.cube.features:
+            flask.abort(400, 'Unknown feature {!r}'.format(feature))
+    if feature1 == feature2:
+        flask.abort(400, 'Crosstab needs two different features')
+    return _respond(data, _crosstab, feature1, feature2)
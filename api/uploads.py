@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Batch submissions over HTTP, the endpoint behind the Submit page's upload.
+
+    curl -F file=@studies.tsv http://localhost:8050/api/submissions
+
+or with the file as the request body. The answer lists the stored
+submission ids and the rejected rows; see datastore.upload for the checks
+and the limits on the size of a file (RTFMRI_MAX_UPLOAD_MB, 10 MB by default;
+the server refuses larger requests before reading them) and its number of
+studies (RTFMRI_MAX_UPLOAD_ROWS, 10000).
+"""
+import flask
+from datastore import upload
+
+blueprint = flask.Blueprint('uploads', __name__, url_prefix='/api')
+
+
+@blueprint.errorhandler(413)
+def too_large(error):
+    return flask.jsonify(error='The file is larger than {:.0f} MB'.format(
+        upload.max_upload_bytes / 1024. / 1024.)), 413
+
+
+@blueprint.route('/submissions', methods=['POST'])
+def submit():
+    if (flask.request.content_length or 0) > flask.current_app.config.get('MAX_CONTENT_LENGTH', float('inf')):
+        flask.abort(413)
+    # Parsing a form would consume any other body, e.g. curl --data-binary's
+    uploaded = flask.request.files.get('file') if flask.request.mimetype == 'multipart/form-data' else None
+    if uploaded is not None:
+        content, filename = uploaded.read(upload.max_upload_bytes + 1), uploaded.filename or ''
+    else:
+        # At most one byte over the limit, for read_table to refuse
+        content, filename = flask.request.stream.read(upload.max_upload_bytes + 1), ''
+    try:
+        result = upload.ingest(content, filename)
+    except upload.UploadError as e:
+        return flask.jsonify(error=str(e)), 400
+    return flask.jsonify(result)
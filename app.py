@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import dash
 import dash_bootstrap_components as dbc
+from api import metrics, profiling
 
 
 # Styling
@@ -24,3 +25,11 @@ app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
 server = app.server
 
 app.config.suppress_callback_exceptions = True
+
+# Per-callback latency and response size at /metrics (RTFMRI_METRICS=0 turns this off)
+if metrics.enabled:
+    metrics.instrument(app)
+
+# Profiles of callbacks slower than RTFMRI_PROFILE_SLOW_MS, under /admin/profiles
+if profiling.enabled:
+    profiling.instrument(app)
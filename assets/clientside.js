@@ -0,0 +1,51 @@
+window.dash_clientside = window.dash_clientside || {};
+
+window.dash_clientside.visualize = {
+
+    // Counts of feature2 among the studies where feature1 == value, read from
+    // the tables in crosstab-store (see CrosstabCube.to_dict in
+    // datastore/aggregates.py). Only one orientation of each feature pair is
+    // stored; the other one is read column-wise.
+    crosstab: function(store, feature1, value, feature2) {
+        var position = store.labels[feature1].indexOf(value);
+        var counts = [];
+        if (position < 0) {
+            return counts;
+        }
+        if (feature1 === feature2) {
+            counts = store.counts[feature1].map(function() { return 0; });
+            counts[position] = store.counts[feature1][position];
+        } else if (store.pairs[feature1] && store.pairs[feature1][feature2]) {
+            counts = store.pairs[feature1][feature2][position];
+        } else {
+            counts = store.pairs[feature2][feature1].map(function(row) { return row[position]; });
+        }
+        return counts;
+    },
+
+    // Clientside version of page2.update_graph_2: bars most common first,
+    // ties in label order, values that do not occur left out.
+    update_graph_2: function(hoverData, feature1, feature2, store) {
+        if (!hoverData || !feature1 || !feature2 || !store) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        var x = hoverData.points[0].x;
+        var counts = window.dash_clientside.visualize.crosstab(store, feature1, x, feature2);
+        var order = counts.map(function(count, i) { return i; })
+            .filter(function(i) { return counts[i] > 0; })
+            .sort(function(a, b) { return (counts[b] - counts[a]) || (a - b); });
+        var txt = store.names[feature2] + ' options when ' + store.names[feature1] + ' = ' + x;
+
+        var fig = {
+            'data': [
+                {
+                    'x': order.map(function(i) { return store.labels[feature2][i]; }),
+                    'y': order.map(function(i) { return counts[i]; }),
+                    'type': 'bar', 'name': txt, 'marker': {'color': '#D3B88C'}
+                },
+            ],
+        };
+
+        return [fig, txt];
+    }
+};
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Latency and peak memory of the app's callbacks, without a browser.
+
+Calls the callbacks (through Dash's wrapper, so serialising the response is
+included) on the real study data and on synthetic datasets of 1k, 10k, 100k
+and 1M studies, with the memoized builders cleared before every call, and
+reports latency percentiles and the peak memory allocated during a call
+(tracemalloc). Results can be saved as JSON and compared with an earlier
+run; the comparison fails (exit status 1) when a case got slower or needs
+more memory than the baseline allows.
+
+    python benchmarks/callbacks.py --output baseline.json
+    python benchmarks/callbacks.py --baseline baseline.json [--tolerance 0.25]
+    python benchmarks/callbacks.py --sizes real 10k --cases page1
+
+Synthetic datasets come from datastore.synthetic (seed 0).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+# Keep the data fixed while measuring (each dataset gets its own empty
+# submissions store, see main)
+os.environ['RTFMRI_WATCH_INTERVAL'] = '0'
+
+import flask  # noqa: E402
+import plotly  # noqa: E402
+import index  # noqa: E402
+from app import app  # noqa: E402
+from datastore import memo, studies, submissions, synthetic  # noqa: E402
+from pages import page1, page2, page3  # noqa: E402
+
+sizes = ['real', '1k', '10k', '100k', '1M']
+
+submission = ['Doe et al. (2020)', '10.0000/benchmark', 'Benchmark study',
+              'Siemens', '3T', 'TBV', 'Y', 'Y', 'DNR', 'Y', 'Y', 'DNR', 'DNR', 'DNR', 'N', ['OFFLINE RETROICOR']]
+
+
+class Submissions(object):
+    # The Submit page's form, with a new DOI for every call (a repeated one is rejected)
+
+    def __init__(self):
+        self.count = 0
+
+    def __len__(self):
+        return 1
+
+    def __getitem__(self, i):
+        if i >= len(self):
+            raise IndexError(i)
+        self.count += 1
+        return tuple([1, submission[0], '{}.{}'.format(submission[1], self.count)] + submission[2:])
+
+
+# Case name -> (callback, argument lists cycled through, the input that
+# triggered each call or None). The submit case stores studies and swaps the
+# snapshot, so it stays last: the read-path cases all see the dataset as loaded.
+cases = {
+    'page1.update_output_div': (page1.update_output_div, [
+        ('', 0, 20, '', []),
+        ('siemens', 0, 20, '', []),
+        ('', 2, 20, '{vendor} = Siemens && {magnet} contains 3', [{'column_id': 'author', 'direction': 'asc'}]),
+        ('tbv', 1, 20, '', [{'column_id': 'magnet', 'direction': 'desc'}, {'column_id': 'doi', 'direction': 'asc'}]),
+        ('vendor=Siemens AND mc=Y AND (ss=4MM OR ss=6MM)', 0, 20, '', []),
+    ], None),
+    'page2.update_graph': (page2.update_graph, [('vendor',), ('software',), ('resp',)], None),
+    'page2.update_graph_2': (page2.update_graph_2, [
+        ({'points': [{'x': 'Siemens'}]}, 'vendor', 'magnet'),
+        ({'points': [{'x': 'TBV'}]}, 'software', 'resp'),
+    ], None),
+    'page2.update_crosstab_store': (page2.update_crosstab_store, [('vendor', None)], None),
+    'page2.generate_table': (page2.generate_table, [
+        ({'points': [{'x': 'Siemens'}]}, 'vendor', '', None, None, {'page': 0}),
+        ({'points': [{'x': 'Siemens'}]}, 'vendor', '', None, 1, {'page': 0}),
+        ({'points': [{'x': 'Siemens'}]}, 'vendor', 'mc = Y AND (ss = 4MM OR ss = 6MM)', None, None, {'page': 0}),
+    ], [None, 'table-1-next.n_clicks', None]),
+    'page2.update_drilldown': (page2.update_drilldown, [
+        (['vendor', 'software', 'mc', 'ss'], 'sunburst'),
+        (['magnet', 'stc', 'mc', 'ss', 'dr', 'hmp'], 'treemap'),
+    ], None),
+    'index.display_page': (index.display_page, [
+        ('/',), ('/pages/page1',), ('/pages/page2',), ('/pages/page3',), ('/nope',),
+    ], None),
+    'page3.update_output': (page3.update_output, Submissions(), None),
+}
+
+
+def parse_size(size):
+    if size == 'real':
+        return None
+    factor = {'k': 1000, 'M': 1000000}.get(size[-1], 1)
+    return int(float(size.rstrip('kM')) * factor)
+
+
+def dataset(size):
+    """StudyData for one of `sizes`, and the seconds it took to build."""
+    start = time.perf_counter()
+    rows = parse_size(size)
+    if rows is None:
+        data = studies.load()
+    else:
+        data = studies.StudyData(synthetic.generate(rows), version='synthetic-{}'.format(rows))
+    return data, time.perf_counter() - start
+
+
+def call(func, args, trigger=None):
+    with app.server.test_request_context():
+        flask.g.triggered_inputs = [{'prop_id': trigger, 'value': 1}] if trigger else []
+        result = func(*args)
+    if not isinstance(result, str):
+        # Plain functions (not registered as callbacks): serialise like Dash
+        result = json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder)
+    return result
+
+
+def clear_caches():
+    for func in memo.memoized:
+        func.cache_clear()
+
+
+def measure(func, variants, triggers, repeat, max_time):
+    triggers = triggers or [None] * len(variants)
+    timings = []
+    deadline = time.perf_counter() + max_time
+    while len(timings) < repeat and (len(timings) < 3 or time.perf_counter() < deadline):
+        i = len(timings) % len(variants)
+        clear_caches()
+        start = time.perf_counter()
+        call(func, variants[i], triggers[i])
+        timings.append(time.perf_counter() - start)
+    peak = 0
+    for args, trigger in zip(variants, triggers):
+        clear_caches()
+        tracemalloc.start()
+        call(func, args, trigger)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    timings = np.array(timings) * 1000
+    return {
+        'calls': len(timings),
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p90_ms': float(np.percentile(timings, 90)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'peak_mb': peak / 1024. / 1024.,
+    }
+
+
+def compare(results, baseline, tolerance, min_ms=1.0, min_mb=1.0):
+    """Cases that are slower (p50) or use more memory than `baseline` allows."""
+    previous = {(r['dataset'], r['case']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get((result['dataset'], result['case']))
+        if base is None:
+            continue
+        for key, floor in (('p50_ms', min_ms), ('peak_mb', min_mb)):
+            if result[key] > base[key] * (1 + tolerance) and result[key] - base[key] > floor:
+                regressions.append((result['dataset'], result['case'], key, base[key], result[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the app callbacks.')
+    parser.add_argument('--sizes', nargs='+', default=sizes, help='datasets: real and/or study counts like 10k')
+    parser.add_argument('--cases', nargs='+', help='only run cases starting with these names')
+    parser.add_argument('--repeat', type=int, default=30, help='calls per case (at least 3)')
+    parser.add_argument('--max-time', type=float, default=10., help='seconds per case before stopping early')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    args = parser.parse_args(argv)
+
+    selected = [name for name in cases if not args.cases or any(name.startswith(c) for c in args.cases)]
+    results = []
+    print('{:<8} {:<28} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+        'dataset', 'case', 'calls', 'p50 ms', 'p90 ms', 'p99 ms', 'peak MB'))
+    for size in args.sizes:
+        # A fresh store, so submissions made while measuring one dataset never
+        # end up in the next
+        submissions.close()
+        submissions.db_path = os.path.join(tempfile.mkdtemp(), 'submissions.db')
+        data, seconds = dataset(size)
+        studies.replace(data)
+        print('{:<8} {:<28} {:>6} {:>10.1f}'.format(size, '(load {} studies)'.format(len(data)), 1, seconds * 1000))
+        for name in selected:
+            func, variants, triggers = cases[name]
+            result = dict(dataset=size, studies=len(data), case=name,
+                          **measure(func, variants, triggers, args.repeat, args.max_time))
+            results.append(result)
+            print('{:<8} {:<28} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                size, name, result['calls'], result['p50_ms'], result['p90_ms'], result['p99_ms'],
+                result['peak_mb']))
+        del data
+        studies.replace(None)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for size, name, key, before, after in regressions:
+            print('REGRESSION {} {} {}: {:.2f} -> {:.2f}'.format(size, name, key, before, after))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against ' + args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Per-worker memory of the app under gunicorn, with and without preloading.
+
+Starts `gunicorn -c gunicorn.conf.py index:server` with 1, 2, 4 and 8
+workers, sends each worker some traffic (pages, search, table and graph
+callbacks), and reads every worker's memory from /proc/<pid>/smaps_rollup
+(Linux only):
+
+- RSS: resident pages, including those shared with the master and siblings
+- USS: pages private to the worker, i.e. what each extra worker costs
+- PSS: shared pages divided among the processes sharing them
+
+With preloading, USS should stay small and flat as the number of workers
+grows, and total PSS grow by about one USS per worker.
+
+    python benchmarks/worker_memory.py [--workers 1 2 4 8] [--json out.json]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Requests a browser session makes: pages, plus the search, table and graph callbacks
+traffic = [
+    ('GET', '/', None),
+    ('GET', '/_dash-layout', None),
+    ('GET', '/_dash-dependencies', None),
+    ('POST', '/_dash-update-component', {
+        'output': '..table.data...table.page_count..',
+        'inputs': [{'id': 'my-id', 'property': 'value', 'value': 'tbv'},
+                   {'id': 'table', 'property': 'page_current', 'value': 0},
+                   {'id': 'table', 'property': 'page_size', 'value': 20},
+                   {'id': 'table', 'property': 'filter_query', 'value': ''},
+                   {'id': 'table', 'property': 'sort_by', 'value': []}],
+        'state': [], 'changedPropIds': []}),
+    ('POST', '/_dash-update-component', {
+        'output': '..graph-1.figure...graph-1-title.children..',
+        'inputs': [{'id': 'drop-1', 'property': 'value', 'value': 'software'}],
+        'state': [], 'changedPropIds': []}),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request('http://127.0.0.1:{}{}'.format(port, path), data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=60) as response:
+        return response.read()
+
+
+def children(pid):
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory(pid):
+    """RSS, USS and PSS of a process in MiB."""
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024.
+    return {'rss': fields['Rss'], 'uss': fields['Private_Clean'] + fields['Private_Dirty'], 'pss': fields['Pss']}
+
+
+def measure(workers, preload, requests_per_worker=20):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               GUNICORN_PRELOAD='1' if preload else '0')
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'index:server'],
+                              cwd=root_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 120
+        while True:
+            try:
+                request(port, 'GET', '/admin/version')
+                if len(children(master.pid)) >= workers:
+                    break
+            except (OSError, IOError):
+                pass
+            if time.time() > deadline or master.poll() is not None:
+                raise RuntimeError('gunicorn did not start')
+            time.sleep(0.2)
+        # Connections are not kept alive, so requests spread over the workers
+        for _ in range(requests_per_worker * workers):
+            for method, path, body in traffic:
+                request(port, method, path, body)
+        usage = [memory(pid) for pid in children(master.pid)]
+        master_usage = memory(master.pid)
+    finally:
+        master.terminate()
+        master.wait()
+    return {
+        'workers': workers,
+        'preload': preload,
+        'master_rss': master_usage['rss'],
+        'worker_rss': sum(u['rss'] for u in usage) / len(usage),
+        'worker_uss': sum(u['uss'] for u in usage) / len(usage),
+        'total_pss': master_usage['pss'] + sum(u['pss'] for u in usage),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure per-worker memory under gunicorn.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    print('{:>8} {:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'preload', 'workers', 'master RSS', 'worker RSS', 'worker USS', 'total PSS'))
+    for preload in (True, False):
+        for workers in args.workers:
+            result = measure(workers, preload)
+            results.append(result)
+            print('{:>8} {:>8} {:>9.1f} MB {:>9.1f} MB {:>9.1f} MB {:>9.1f} MB'.format(
+                'yes' if preload else 'no', workers, result['master_rss'], result['worker_rss'],
+                result['worker_uss'], result['total_pss']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
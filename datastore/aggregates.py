@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from datastore.memo import memoize
+
+
+class CrosstabCube(object):
+    """Per-feature counts and pairwise contingency tables of the coded columns.
+
+    Built once from the integer codes of a StudyData instance, after which
+    counting a feature, or counting feature2 among the studies where feature1
+    equals some value, is a dictionary lookup plus a row of a small array.
+    `add_study` / `remove_study` count one more or one less study, growing
+    the tables when a study brings a new value; that costs O(features^2)
+    work per study, independent of the number of studies. Snapshots with
+    submissions apply them this way to a `copy` of the curated studies'
+    cube (see studies.with_submissions). `generation` counts the updates.
+    """
+
+    def __init__(self, data, features=None):
+        self.features = list(features if features is not None else data.coded)
+        self.labels = {}
+        self.positions = {}
+        self.counts = {}
+        self.pairs = {}
+        self.generation = 0
+        self._options = {}
+        codes = {}
+        for feature in self.features:
+            labels = [str(val) for val in data.labels(feature)]
+            self.labels[feature] = labels
+            self.positions[feature] = {label: i for i, label in enumerate(labels)}
+            codes[feature] = data.codes(feature).astype(np.int64)
+            valid = codes[feature] >= 0
+            self.counts[feature] = np.bincount(codes[feature][valid], minlength=len(labels))
+        for feature1, feature2 in combinations(self.features, 2):
+            n1, n2 = len(self.labels[feature1]), len(self.labels[feature2])
+            valid = (codes[feature1] >= 0) & (codes[feature2] >= 0)
+            flat = codes[feature1][valid] * n2 + codes[feature2][valid]
+            self.pairs[(feature1, feature2)] = np.bincount(flat, minlength=n1 * n2).reshape(n1, n2)
+
+    def copy(self):
+        """Independent copy, for applying updates without changing this cube."""
+        cube = CrosstabCube.__new__(CrosstabCube)
+        cube.features = list(self.features)
+        cube.labels = {feature: list(labels) for feature, labels in self.labels.items()}
+        cube.positions = {feature: dict(positions) for feature, positions in self.positions.items()}
+        cube.counts = {feature: counts.copy() for feature, counts in self.counts.items()}
+        cube.pairs = {key: table.copy() for key, table in self.pairs.items()}
+        cube.generation = self.generation
+        cube._options = {}
+        return cube
+
+    def table(self, feature1, feature2):
+        """Counts of studies per (feature1 value, feature2 value), by position."""
+        if (feature1, feature2) in self.pairs:
+            return self.pairs[(feature1, feature2)]
+        return self.pairs[(feature2, feature1)].T
+
+    def _series(self, feature, counts):
+        order = np.argsort(-counts, kind='mergesort')
+        order = order[counts[order] > 0]
+        labels = self.labels[feature]
+        return pd.Series(counts[order], index=[labels[i] for i in order], name=feature)
+
+    def value_counts(self, feature):
+        """Counts per value of `feature`, most common first."""
+        return self._series(feature, self.counts[feature])
+
+    def options(self, feature):
+        """Dropdown options for `feature`, most common value first."""
+        generation, options = self._options.get(feature, (None, None))
+        if generation != self.generation:
+            options = [{'label': val, 'value': val} for val in self.value_counts(feature).index]
+            self._options[feature] = (self.generation, options)
+        return options
+
+    def crosstab(self, feature1, value, feature2):
+        """Counts per value of `feature2` among studies with feature1 == value."""
+        position = self.positions[feature1].get(value)
+        if position is None:
+            return self._series(feature2, np.zeros(0, dtype=np.int64))
+        if feature1 == feature2:
+            counts = np.zeros(len(self.labels[feature1]), dtype=np.int64)
+            counts[position] = self.counts[feature1][position]
+            return self._series(feature2, counts)
+        return self._series(feature2, self.table(feature1, feature2)[position])
+
+    def _position(self, feature, value):
+        """Position of `value` in the tables of `feature`, growing them if new."""
+        position = self.positions[feature].get(value)
+        if position is not None:
+            return position
+        position = len(self.labels[feature])
+        self.labels[feature].append(value)
+        self.positions[feature][value] = position
+        self.counts[feature] = np.append(self.counts[feature], 0)
+        for key, table in self.pairs.items():
+            if key[0] == feature:
+                self.pairs[key] = np.vstack([table, np.zeros((1, table.shape[1]), dtype=table.dtype)])
+            elif key[1] == feature:
+                self.pairs[key] = np.hstack([table, np.zeros((table.shape[0], 1), dtype=table.dtype)])
+        return position
+
+    def _update(self, study, step):
+        positions = {}
+        for feature in self.features:
+            value = study.get(feature)
+            if value is not None:
+                positions[feature] = self._position(feature, str(value))
+                self.counts[feature][positions[feature]] += step
+        for feature1, feature2 in self.pairs:
+            if feature1 in positions and feature2 in positions:
+                self.pairs[(feature1, feature2)][positions[feature1], positions[feature2]] += step
+        self.generation += 1
+
+    def add_study(self, study):
+        """Count one more study, given as a {feature: value} mapping."""
+        self._update(study, 1)
+
+    def remove_study(self, study):
+        """Stop counting a study previously passed to `add_study`."""
+        self._update(study, -1)
+
+    def to_dict(self):
+        """JSON-serialisable copy of the labels and pairwise tables.
+
+        `pairs[feature1][feature2]` is the table for the pair in the order
+        of `features`; the reverse pair is its transpose.
+        """
+        pairs = {}
+        for (feature1, feature2), table in self.pairs.items():
+            pairs.setdefault(feature1, {})[feature2] = table.tolist()
+        return {
+            'generation': self.generation,
+            'features': self.features,
+            'labels': self.labels,
+            'counts': {feature: counts.tolist() for feature, counts in self.counts.items()},
+            'pairs': pairs,
+        }
+
+
+@memoize(maxsize=64)
+def group_tree(data, path):
+    """Study counts per value combination along an ordered feature path.
+
+    For `path` = ('vendor', 'software'), the tree has a root for all
+    studies, a node per vendor and below each a node per software used with
+    it, as parallel lists in the form plotly's sunburst and treemap take:
+    `ids`, `labels`, `parents` and `values` (counts, each parent the sum of
+    its children), plus the `feature` of each node. Studies missing a value
+    on the path are left out. Built with one grouping of the leaf level,
+    from which every level above is summed, and cached per path.
+    """
+    path = list(path)
+    sizes = [len(data.labels(feature)) for feature in path]
+    codes = [data.codes(feature).astype(np.int64) for feature in path]
+    valid = np.logical_and.reduce([c >= 0 for c in codes])
+    leaves, counts = np.unique(np.ravel_multi_index([c[valid] for c in codes], sizes), return_counts=True)
+    leaf_codes = np.unravel_index(leaves, sizes)
+
+    tree = {'ids': ['all'], 'labels': ['All studies'], 'parents': [''], 'values': [int(counts.sum())],
+            'feature': ['']}
+    parent_ids = np.array(['all'], dtype=object)
+    parent_of_leaf = np.zeros(len(leaves), dtype=np.int64)
+    for depth, feature in enumerate(path):
+        prefix = np.ravel_multi_index(leaf_codes[:depth + 1], sizes[:depth + 1])
+        nodes, first, inverse = np.unique(prefix, return_index=True, return_inverse=True)
+        labels = np.asarray([str(val) for val in data.labels(feature)], dtype=object)[leaf_codes[depth][first]]
+        ids = parent_ids[parent_of_leaf[first]] + '/' + feature + '=' + labels
+        tree['ids'].extend(ids)
+        tree['labels'].extend(labels)
+        tree['parents'].extend(parent_ids[parent_of_leaf[first]])
+        tree['values'].extend(np.bincount(inverse.ravel(), counts).astype(np.int64).tolist())
+        tree['feature'].extend([feature] * len(nodes))
+        parent_ids, parent_of_leaf = ids, inverse.ravel()
+    return tree
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Binary columnar cache of the parsed study table.
+
+Parsing the carriage-return terminated TSV is the slowest part of starting
+a worker, so the parsed (and encoded) frame is written next to a small JSON
+file recording the source's mtime, size and SHA-1, and the schema the parser
+produced (see studies.cache_schema). A later start loads the binary copy when
+the source and the schema are unchanged, and re-parses and rewrites it when
+they are not. Each source file has its own cache, named after its full path.
+
+Feather (via pyarrow) is used when pyarrow is installed, pickle otherwise.
+Prebuild the cache at deploy time with:
+
+    python -m datastore.cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    cache_format = 'feather'
+except ImportError:
+    cache_format = 'pickle'
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Not under assets/, which Dash serves to anyone who asks
+cache_dir = os.environ.get('RTFMRI_CACHE_DIR', os.path.join(root_dir, '.cache'))
+
+
+def file_digest(path):
+    """SHA-1 hex digest of a file's contents."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def cache_paths(source, fmt=None):
+    """Paths of the cached frame and of its metadata for a source file."""
+    fmt = fmt or cache_format
+    source = os.path.abspath(source)
+    name = '{}-{}'.format(os.path.splitext(os.path.basename(source))[0],
+                          hashlib.sha1(source.encode('utf-8')).hexdigest()[:12])
+    return (os.path.join(cache_dir, name + '.' + fmt),
+            os.path.join(cache_dir, name + '.json'))
+
+
+def write_frame(df, path, fmt=None):
+    """Write a frame in one of the binary formats, atomically."""
+    fmt = fmt or cache_format
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    if fmt == 'feather':
+        df.reset_index(drop=True).to_feather(tmp)
+    else:
+        df.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def read_frame(path, fmt=None):
+    """Read a frame written by `write_frame`."""
+    fmt = fmt or cache_format
+    if fmt == 'feather':
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, stat, digest, schema):
+    meta = {'format': cache_format, 'schema': schema, 'mtime': stat.st_mtime, 'size': stat.st_size,
+            'sha1': digest}
+    tmp = '{}.{}.tmp'.format(meta_path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def validate(source, schema=''):
+    """SHA-1 of `source` if its cache matches the file's contents and was
+    written for `schema`, else None.
+
+    An unchanged mtime and size is trusted as is; otherwise the source is
+    hashed, so that touching or re-copying the file does not force a rebuild
+    (the recorded mtime is refreshed instead).
+    """
+    meta_path = cache_paths(source)[1]
+    meta = _read_meta(meta_path)
+    if not meta or meta.get('format') != cache_format or meta.get('schema') != schema:
+        return None
+    stat = os.stat(source)
+    if meta.get('mtime') == stat.st_mtime and meta.get('size') == stat.st_size:
+        return meta['sha1']
+    digest = file_digest(source)
+    if digest != meta.get('sha1'):
+        return None
+    try:
+        _write_meta(meta_path, stat, digest, schema)
+    except (IOError, OSError):
+        pass
+    return digest
+
+
+def build(source, parse, schema=''):
+    """Parse `source` with `parse` and (re)write its cache for `schema`;
+    returns (df, sha1)."""
+    stat = os.stat(source)
+    digest = file_digest(source)
+    df = parse(source)
+    frame_path, meta_path = cache_paths(source)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_frame(df, frame_path)
+        _write_meta(meta_path, stat, digest, schema)
+    except (IOError, OSError):
+        # A read-only deployment still works, it just parses every time
+        pass
+    return df, digest
+
+
+def load(source, parse, schema=''):
+    """Frame for `source`, from the cache when valid for `schema`; returns
+    (df, sha1)."""
+    digest = validate(source, schema)
+    if digest is not None:
+        frame_path = cache_paths(source)[0]
+        try:
+            return read_frame(frame_path), digest
+        except Exception:
+            pass
+    return build(source, parse, schema)
+
+
+def main(argv=None):
+    from datastore import studies
+
+    parser = argparse.ArgumentParser(description='Prebuild the binary cache of the study dataset.')
+    parser.add_argument('source', nargs='?', default=studies.filename, help='study TSV file')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the cache is valid')
+    args = parser.parse_args(argv)
+
+    frame_path = cache_paths(args.source)[0]
+    if not args.force and validate(args.source, studies.cache_schema) is not None:
+        print('Cache is up to date: ' + frame_path)
+        return
+    df, digest = build(args.source, studies.read_studies, studies.cache_schema)
+    print('Wrote {} ({} studies, sha1 {})'.format(frame_path, len(df), digest[:12]))
+
+
+if __name__ == '__main__':
+    main()
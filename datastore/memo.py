@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from functools import wraps
+import threading
+
+# Every memoized builder, so their counters can be reported together
+memoized = []
+
+
+def memoize(maxsize=128):
+    """Bounded LRU cache for functions that build output from the study data.
+
+    The decorated function is called as `func(data, *args)`, with `data` a
+    StudyData snapshot and hashable `args`. The cache key is the args plus
+    `data.version`, so entries built from older data are never returned and
+    simply age out. The wrapper has `cache_info()` (hits, misses, size) and
+    `cache_clear()`, like functools.lru_cache.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        stats = {'hits': 0, 'misses': 0}
+
+        @wraps(func)
+        def wrapper(data, *args):
+            key = (data.version,) + args
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    stats['hits'] += 1
+                    return cache[key]
+                stats['misses'] += 1
+            result = func(data, *args)
+            with lock:
+                cache[key] = result
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        def cache_info():
+            with lock:
+                return {'hits': stats['hits'], 'misses': stats['misses'],
+                        'size': len(cache), 'maxsize': maxsize}
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats['hits'] = stats['misses'] = 0
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        memoized.append(wrapper)
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """Hit/miss counters of all memoized builders, keyed by qualified name."""
+    return {func.__module__ + '.' + func.__name__: func.cache_info() for func in memoized}
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Boolean queries over the coded columns, answered from bitmap indexes.
+
+A query combines `feature = value` (or `!=`) conditions with AND, OR, NOT
+and parentheses, e.g.
+
+    vendor = Siemens AND mc = Y AND (ss = 4MM OR ss = 6MM)
+
+Features are the column keys (`vendor`) or names (`Vendor`); values are the
+labels, in any case, and may contain spaces (`resp = RT + OFFLINE CORR`) or
+be quoted. AND binds tighter than OR. Where a feature is expected, `or`
+(outlier removal) is the column key rather than the keyword:
+
+    mc = Y AND or = KALMAN
+
+`BitmapIndex` holds one bitset per (feature, value), as 64-bit words with
+bit i for study i (per segment, see BitmapIndex.concat), so a query is evaluated as a few whole-word AND/OR/NOT
+operations over n/64 words, whatever the number of conditions.
+"""
+import re
+import numpy as np
+from datastore.memo import memoize
+
+
+class QueryError(ValueError):
+    """A query that cannot be parsed."""
+
+
+class BitmapIndex(object):
+    """One bitset per (coded column, value) of a StudyData instance."""
+
+    def __init__(self, data, names=None):
+        self.nrows = len(data)
+        self.nwords = -(-self.nrows // 64)
+        # Studies per segment, each starting on a new word (see concat)
+        self.segments = [self.nrows]
+        self.features = list(data.coded)
+        self.labels = {}
+        self.bitsets = {}
+        for feature in self.features:
+            labels = [str(val) for val in data.labels(feature)]
+            codes = data.codes(feature)
+            bitsets = np.zeros((len(labels), self.nwords), dtype=np.uint64)
+            for code in range(len(labels)):
+                bitsets[code] = self.pack(codes == code)
+            bitsets.flags.writeable = False
+            self.labels[feature] = labels
+            self.bitsets[feature] = bitsets
+        self._finish(names)
+
+    def _finish(self, names):
+        self.all = self.pack(np.ones(self.nrows, dtype=bool))
+        self.none = np.zeros(self.nwords, dtype=np.uint64)
+        self.all.flags.writeable = self.none.flags.writeable = False
+        # Lookups by lower case feature key or name, and exact or upper case value
+        self._features = {feature.lower(): feature for feature in self.features}
+        self._features.update({name.lower(): feature for feature, name in (names or {}).items()
+                               if feature in self.labels})
+        self._codes = {}
+        for feature, labels in self.labels.items():
+            codes = {label.upper(): code for code, label in enumerate(labels)}
+            codes.update((label, code) for code, label in enumerate(labels))
+            self._codes[feature] = codes
+
+    @classmethod
+    def concat(cls, first, second, names=None):
+        """Index of the studies of `first` followed by those of `second`.
+
+        `second` must have all of `first`'s labels, in the same positions,
+        as the delta of a studies.MergedStudyData has. The bitsets are put
+        side by side, so `second` starts on a new word: the first index's
+        words are copied, not recomputed.
+        """
+        index = cls.__new__(cls)
+        index.nrows = first.nrows + second.nrows
+        index.nwords = first.nwords + second.nwords
+        index.segments = first.segments + second.segments
+        index.features = list(second.features)
+        index.labels = second.labels
+        index.bitsets = {}
+        for feature in index.features:
+            bitsets = np.zeros((len(second.labels[feature]), index.nwords), dtype=np.uint64)
+            bitsets[:len(first.labels[feature]), :first.nwords] = first.bitsets[feature]
+            bitsets[:, first.nwords:] = second.bitsets[feature]
+            bitsets.flags.writeable = False
+            index.bitsets[feature] = bitsets
+        index._finish(names)
+        return index
+
+    def pack(self, mask):
+        """Bitset of a boolean mask over the studies."""
+        words = np.zeros(self.nwords * 8, dtype=np.uint8)
+        start = offset = 0
+        for nrows in self.segments:
+            packed = np.packbits(mask[start:start + nrows], bitorder='little')
+            words[offset:offset + len(packed)] = packed
+            start += nrows
+            offset += -(-nrows // 64) * 8
+        return words.view('<u8').astype(np.uint64)
+
+    def unpack(self, bits):
+        """Boolean mask of a bitset."""
+        if len(self.segments) == 1:
+            return np.unpackbits(bits.astype('<u8').view(np.uint8), count=self.nrows, bitorder='little').view(bool)
+        masks = []
+        offset = 0
+        for nrows in self.segments:
+            nwords = -(-nrows // 64)
+            words = bits[offset:offset + nwords].astype('<u8').view(np.uint8)
+            masks.append(np.unpackbits(words, count=nrows, bitorder='little').view(bool))
+            offset += nwords
+        return np.concatenate(masks)
+
+    def feature(self, name):
+        """Column key for a feature key or name (any case), or None."""
+        return self._features.get(name.strip().lower())
+
+    def bitset(self, feature, value):
+        """Bitset of the studies where `feature` equals `value` (any case)."""
+        codes = self._codes[feature]
+        code = codes.get(value, codes.get(value.upper()))
+        return self.none if code is None else self.bitsets[feature][code]
+
+
+# Tokens: parentheses, comparisons, quoted strings, and runs of anything else
+_tokens = re.compile(r'\s*(\(|\)|!=|=|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^()=!"\'\s]+|!)')
+_keywords = ('AND', 'OR', 'NOT')
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _tokens.match(text, position)
+        if not match:
+            position = len(text) - len(text[position:].lstrip())
+            raise QueryError('Unexpected {!r} at position {}'.format(text[position], position))
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+
+    def __init__(self, text, index):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.index = index
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise QueryError('Unexpected end of query')
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        token = self.peek()
+        if token is not None and token.upper() == word:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.disjunction()
+        if self.peek() is not None:
+            raise QueryError('Unexpected {!r}'.format(self.peek()))
+        return node
+
+    def disjunction(self):
+        terms = [self.conjunction()]
+        while self.keyword('OR'):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else ('or',) + tuple(terms)
+
+    def conjunction(self):
+        terms = [self.negation()]
+        while self.keyword('AND'):
+            terms.append(self.negation())
+        return terms[0] if len(terms) == 1 else ('and',) + tuple(terms)
+
+    def negation(self):
+        if self.keyword('NOT'):
+            return ('not', self.negation())
+        if self.peek() == '(':
+            self.next()
+            node = self.disjunction()
+            if self.next() != ')':
+                raise QueryError('Missing )')
+            return node
+        return self.condition()
+
+    def words(self):
+        # A name or value: a quoted string, or words up to the next operator
+        token = self.peek()
+        if token is not None and token[0] in '"\'':
+            self.next()
+            return token[1:-1].replace('\\' + token[0], token[0])
+        words = []
+        while self.peek() is not None and self.peek() not in ('(', ')', '=', '!=') \
+                and self.peek().upper() not in _keywords:
+            words.append(self.next())
+        if not words:
+            raise QueryError('Expected a feature or value, got {!r}'.format(self.peek() or 'the end'))
+        return ' '.join(words)
+
+    def condition(self):
+        token = self.peek()
+        if token is not None and token.upper() in _keywords and self.index.feature(token) is not None \
+                and self.position + 1 < len(self.tokens) and self.tokens[self.position + 1] in ('=', '!='):
+            # A column key spelled like a keyword (`or`, outlier removal)
+            name = self.next()
+        else:
+            name = self.words()
+        feature = self.index.feature(name)
+        if feature is None:
+            raise QueryError('Unknown feature {!r}'.format(name))
+        operator = self.next()
+        if operator not in ('=', '!='):
+            raise QueryError('Expected = or != after {!r}'.format(name))
+        node = ('eq', feature, self.words())
+        return ('not', node) if operator == '!=' else node
+
+
+def evaluate(index, node):
+    """Bitset of the studies matching a syntax tree."""
+    kind = node[0]
+    if kind == 'eq':
+        return index.bitset(node[1], node[2])
+    if kind == 'not':
+        return index.all & ~evaluate(index, node[1])
+    if kind == 'and':
+        bits = evaluate(index, node[1]) & evaluate(index, node[2])
+        for child in node[3:]:
+            bits &= evaluate(index, child)
+        return bits
+    bits = evaluate(index, node[1]) | evaluate(index, node[2])
+    for child in node[3:]:
+        bits |= evaluate(index, child)
+    return bits
+
+
+def equals(feature, value):
+    """Syntax tree of a single `feature = value` condition."""
+    return ('eq', feature, value)
+
+
+def both(node1, node2):
+    """Syntax tree matching the studies matched by both trees."""
+    return ('and', node1, node2)
+
+
+@memoize(maxsize=256)
+def parse(data, text):
+    """Syntax tree of a query on `data`, as nested tuples.
+
+    Nodes are ('eq', feature, value), ('not', node), ('and', node, ...) and
+    ('or', node, ...), with features resolved to their keys. Raises
+    QueryError when the query cannot be parsed.
+    """
+    return _Parser(text, data.bitmaps()).parse()
+
+
+@memoize(maxsize=256)
+def select(data, node):
+    """Bitset of the studies in `data` matching a syntax tree."""
+    bits = evaluate(data.bitmaps(), node)
+    bits.flags.writeable = False
+    return bits
+
+
+def mask(data, node):
+    """Boolean mask of the studies matching a syntax tree or query text."""
+    if isinstance(node, str):
+        node = parse(data, node)
+    return data.bitmaps().unpack(select(data, node))
+
+
+def rows(data, node):
+    """Row positions of the studies matching a syntax tree or query text."""
+    return np.flatnonzero(mask(data, node))
+
+
+def is_query(text):
+    """Whether search box input is meant as a query rather than a search term."""
+    return bool(text) and '=' in text
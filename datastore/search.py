@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+# Padding appended to every indexed cell, so that each character position
+# starts exactly one n-gram (also the last n-1 characters of a cell)
+PAD = '\0'
+
+
+class SearchIndex(object):
+    """Inverted index for case-insensitive substring search over a frame.
+
+    Matches are identical to
+    `df[col].str.contains(term, case=False, regex=False)` OR-ed over all
+    columns, but are resolved through index lookups instead of a scan:
+
+    - categorical (coded) columns only hold a few labels, so the term is
+      matched against the labels and the rows are found through the codes;
+    - free text columns (author, doi) get an n-gram index. Terms of length
+      >= n intersect the postings of their n-grams and the few candidates are
+      verified; shorter terms are answered from prefix postings directly.
+    """
+
+    def __init__(self, df, n=3):
+        self.n = n
+        self.nrows = len(df)
+        self.coded = {}
+        self.text = []
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                labels = [str(val).upper() for val in df[col].cat.categories]
+                self.coded[col] = (labels, df[col].cat.codes.values)
+            else:
+                self.text.append([str(val).upper() for val in df[col].values])
+        self.postings = self._build_postings()
+        self.prefixes = self._build_prefixes()
+
+    def _build_postings(self):
+        postings = defaultdict(list)
+        pad = PAD * (self.n - 1)
+        for row, cells in enumerate(zip(*self.text)):
+            grams = set()
+            for cell in cells:
+                padded = cell + pad
+                grams.update(padded[i:i + self.n] for i in range(len(cell)))
+            for gram in grams:
+                postings[gram].append(row)
+        return {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def _build_prefixes(self):
+        prefixes = defaultdict(list)
+        for gram, rows in self.postings.items():
+            for k in range(1, self.n):
+                if PAD not in gram[:k]:
+                    prefixes[gram[:k]].append(rows)
+        return {key: np.unique(np.concatenate(rows)) for key, rows in prefixes.items()}
+
+    def _text_rows(self, term):
+        if len(term) < self.n:
+            return self.prefixes.get(term, np.empty(0, dtype=np.int32))
+        grams = sorted({term[i:i + self.n] for i in range(len(term) - self.n + 1)},
+                       key=lambda gram: len(self.postings.get(gram, ())))
+        rows = self.postings.get(grams[0], np.empty(0, dtype=np.int32))
+        for gram in grams[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, self.postings.get(gram, ()), assume_unique=True)
+        if len(term) > self.n:
+            rows = np.array([row for row in rows
+                             if any(term in cells[row] for cells in self.text)], dtype=np.int32)
+        return rows
+
+    def lookup(self, term):
+        """Boolean mask of the rows where any column contains `term`."""
+        mask = np.zeros(self.nrows, dtype=bool)
+        if term is None:
+            return mask
+        term = term.upper()
+        if not term:
+            mask[:] = True
+            return mask
+        for labels, codes in self.coded.values():
+            matched = [code for code, label in enumerate(labels) if term in label]
+            if matched:
+                mask |= np.isin(codes, matched)
+        if PAD not in term:
+            mask[self._text_rows(term)] = True
+        return mask
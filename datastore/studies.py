@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from datastore import cache
+from datastore.aggregates import CrosstabCube
+from datastore.query import BitmapIndex
+from datastore.search import SearchIndex
+
+# Location of the coded study data, resolved relative to the repository so
+# that the app does not depend on the working directory of the process;
+# RTFMRI_STUDIES_FILE points the app at another file, e.g. a synthetic one
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+filename = os.environ.get('RTFMRI_STUDIES_FILE', os.path.join(
+    root_dir, 'assets', 'rtfMRI_methods_review_included_studies_procsteps.txt'))
+
+colnames = {
+    'author':'Author',
+    'vendor': 'Vendor',
+    'magnet': 'Field strength',
+    'software': 'Software',
+    'stc': 'Slice time correction',
+    'mc': '3D volume realignment',
+    'ss': 'Spatial smoothing',
+    'dr': 'Drift removal',
+    'hmp': 'Realignment parameter regression',
+    'ts': 'Temporal smoothing',
+    'ff': 'Frequency filtering',
+    'or': 'Outlier removal',
+    'droi': 'Differential ROI',
+    'resp': 'Respiratory noise removal',
+    'doi': 'Article DOI'
+}
+
+# Coded columns, i.e. everything except the free text author and doi fields
+features = [key for key in colnames.keys() if key not in ('author', 'doi')]
+
+plotnames = [{'label': colnames[key], 'value': key} for key in features]
+
+# Whether studies submitted through the Submit page (datastore.submissions)
+# are browsed and plotted together with the curated dataset
+include_submissions = os.environ.get('RTFMRI_INCLUDE_SUBMISSIONS', '1') != '0'
+
+# Seconds between checks for submissions made through other processes
+sync_interval = 1.0
+
+
+# Identifies what read_studies produces, so that caches of frames parsed
+# differently are rebuilt (see datastore.cache); bump the version when the
+# parsing or encoding changes
+cache_version = 1
+cache_schema = hashlib.sha1(json.dumps([cache_version, list(colnames.items()), features]).encode()).hexdigest()
+
+
+def read_studies(path=filename):
+    """Parse the tab separated study file into a DataFrame."""
+    df = pd.read_csv(path, sep='\t', lineterminator='\r')
+    return encode(df.dropna(axis='columns'))
+
+
+def encode(df):
+    """Dictionary-encode the coded columns as pandas categoricals.
+
+    Each coded column only holds a handful of distinct codes, so storing
+    them as small integer codes plus a label dictionary (the categories)
+    keeps the frame compact and makes counting and filtering integer work.
+    """
+    return df.astype({key: 'category' for key in features if key in df.columns})
+
+
+def fill_missing(df, columns):
+    """The `columns` of `df`, with empty fields as 'DNR' (did not report)
+    in the coded columns and '' in the others."""
+    df = df.reindex(columns=columns)
+    return df.fillna({col: 'DNR' if col in features else '' for col in columns})
+
+
+def merge_ranks(ranks, values, more):
+    """Sort keys for `values` followed by `more`, from the ranks of `values`.
+
+    `ranks` are the dense ranks of `values` (see StudyData.rank). They are
+    kept, spread out by a step, and `more` is placed on or between them, so
+    only `more` is sorted.
+    """
+    first = np.zeros(ranks.max() + 1 if len(ranks) else 0, dtype=np.int64)
+    first[ranks[::-1]] = np.arange(len(ranks) - 1, -1, -1)
+    ordered = np.asarray(values, dtype=object)[first]
+    unique, inverse = np.unique(np.asarray(more).astype(str), return_inverse=True)
+    unique = unique.astype(object)
+    position = np.searchsorted(ordered, unique)
+    exact = np.zeros(len(unique), dtype=bool)
+    found = position < len(ordered)
+    exact[found] = ordered[position[found]] == unique[found]
+    step = len(unique) + 1
+    keys = position.astype(np.int64) * step
+    # New values go just below the next known one, in their own order
+    between = np.flatnonzero(~exact)
+    end = np.searchsorted(position[between], position[between], 'right')
+    keys[between] -= end - np.arange(len(between))
+    return np.concatenate([ranks.astype(np.int64) * step, keys[inverse.ravel()]])
+
+
+def doi_link(df):
+    """Markdown link to the article behind each DOI."""
+    return '[' + df['doi'] + ']' + '(https://doi.org/' + df['doi'] + ')'
+
+
+def year(df):
+    """Publication year, the first four-digit number in the author field."""
+    return pd.to_numeric(df['author'].str.extract(r'(\d{4})', expand=False), errors='coerce')
+
+
+def first_author(df):
+    """Surname of the first author, without 'et al.', year or co-citations."""
+    return df['author'].str.split(r' et al|,| \(|;', n=1).str[0].str.strip()
+
+
+# Columns computed from the source columns once at load time, in order. Each
+# entry is (name, function of the study frame returning a Series); every
+# function works on whole columns, so adding one costs a few vectorized
+# string operations rather than a loop over the studies.
+derived_columns = [
+    ('doi_link', doi_link),
+    ('year', year),
+    ('first_author', first_author),
+]
+
+
+def derive(df, columns=derived_columns):
+    """Frame of the derived columns, aligned with `df`."""
+    derived = pd.DataFrame(index=df.index)
+    for name, func in columns:
+        derived[name] = func(df)
+    return derived
+
+
+class StudyData(object):
+    """Read-only study frame plus the views that the pages derive from it.
+
+    A single instance is shared by all pages (see `get`). Callers must treat
+    `df` as read-only; derived views are computed once on first access.
+    `version` identifies the data, e.g. for keying caches of derived output.
+    `derived` holds the `derived_columns`, kept apart from `df` so that the
+    table, search and counts only ever see the source columns.
+
+    A snapshot never changes. Submitted studies are added by a
+    MergedStudyData, which shares this one's views; `changes_seq` is the
+    submission change it is up to date with (see `refresh`). `stamps` are
+    those of the study file and the reload trigger when it was loaded (see
+    `load`), or None if it was not loaded from the study file.
+    """
+
+    def __init__(self, df, version=None):
+        self.df = df
+        self.version = version
+        self.changes_seq = 0
+        self.stamps = None
+        self.checked_at = time.time()
+        self.derived = derive(df)
+        self.index = SearchIndex(df)
+        self.coded = [key for key in features if key in df.columns]
+        self.cube = CrosstabCube(self)
+        self._records = None
+        self._ranks = {}
+        self._groups = {}
+        self._bitmaps = None
+        self._dois = None
+
+    def __len__(self):
+        return len(self.df)
+
+    def records(self, rows=None):
+        """Table rows with the DOI rendered as a markdown link.
+
+        `rows` optionally selects a subset of the studies (a boolean numpy
+        mask or an array of row positions); only those rows are converted.
+        """
+        if rows is None:
+            if self._records is None:
+                self._records = self._to_records(slice(None))
+            return self._records
+        return self._to_records(rows)
+
+    def _to_records(self, rows):
+        df = self.df.iloc[rows]
+        df = df.assign(doi=self.derived['doi_link'].values[rows])
+        return df.to_dict('records')
+
+    def search(self, term):
+        """Boolean mask of the studies with `term` in any column (any case)."""
+        return self.index.lookup(term)
+
+    def labels(self, feature):
+        """Label dictionary of a coded column (position == integer code)."""
+        return self.df[feature].cat.categories
+
+    def codes(self, feature, df=None):
+        """Integer codes of a coded column, -1 where the value is missing."""
+        if df is None:
+            df = self.df
+        return df[feature].cat.codes.values
+
+    def mask(self, feature, value):
+        """Boolean mask of the studies where `feature` equals `value`."""
+        labels = self.labels(feature)
+        if value not in labels:
+            return np.zeros(len(self.df), dtype=bool)
+        return self.codes(feature) == labels.get_loc(value)
+
+    def column(self, col, rows=None):
+        """Values of one column as a numpy array, optionally only at `rows`.
+
+        Coded columns are decoded from their integer codes, so only the
+        selected rows are materialized as strings.
+        """
+        if col in self.coded:
+            codes = self.codes(col) if rows is None else self.codes(col)[rows]
+            return np.asarray(self.labels(col), dtype=object)[codes]
+        values = self.df[col].values
+        return values if rows is None else values[rows]
+
+    def rows(self, feature, value):
+        """Row positions of the studies where `feature` equals `value`.
+
+        The rows of every value are grouped once per feature (a stable
+        argsort of the codes), after which this is a lookup.
+        """
+        labels = self.labels(feature)
+        if value not in labels:
+            return np.empty(0, dtype=np.int64)
+        return self._group(feature)[labels.get_loc(value)]
+
+    def _group(self, feature):
+        if feature not in self._groups:
+            codes = self.codes(feature)
+            order = np.argsort(codes, kind='mergesort')
+            bounds = np.cumsum(np.bincount(codes[codes >= 0], minlength=len(self.labels(feature))))
+            start = np.count_nonzero(codes < 0)
+            self._groups[feature] = np.split(order[start:], bounds[:-1])
+        return self._groups[feature]
+
+    def existing_dois(self, dois):
+        """Those of `dois` (lower case) that studies here have.
+
+        The studies' DOIs are compared stripped and lower-cased, normalised
+        once per snapshot.
+        """
+        if self._dois is None:
+            self._dois = frozenset(self.df['doi'].astype(str).str.strip().str.lower())
+        return {doi for doi in dois if doi in self._dois}
+
+    def bitmaps(self):
+        """Bitsets per value of the coded columns, for datastore.query."""
+        if self._bitmaps is None:
+            self._bitmaps = BitmapIndex(self, colnames)
+        return self._bitmaps
+
+    def rank(self, col):
+        """Integer sort keys of a column, consistent with sorting its values."""
+        if col not in self._ranks:
+            if col in self.coded:
+                # categories are kept sorted, so the codes already sort
+                self._ranks[col] = self.codes(col).astype(np.int64)
+            else:
+                values = self.df[col].values.astype(str)
+                self._ranks[col] = np.unique(values, return_inverse=True)[1].astype(np.int64)
+        return self._ranks[col]
+
+    def value_counts(self, feature, df=None):
+        """Counts per value of a coded column, most common first.
+
+        `df` optionally restricts the counts to a subset of `self.df` (for
+        instance `self.df.loc[mask]`); unused labels are left out.
+        """
+        labels = self.labels(feature)
+        codes = self.codes(feature, df)
+        counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+        order = np.argsort(-counts, kind='mergesort')
+        order = order[counts[order] > 0]
+        return pd.Series(counts[order], index=labels[order], name=feature)
+
+    def options(self, feature):
+        """Dropdown options for a coded column, most common value first."""
+        return self.cube.options(feature)
+
+    def warm(self):
+        """Compute all lazily derived views now instead of on first use.
+
+        Used when preloading in the gunicorn master (see gunicorn.conf.py),
+        so that forked workers share these views instead of each building
+        their own copy.
+        """
+        self.records()
+        for col in self.df.columns:
+            self.rank(col)
+        for feature in self.coded:
+            self._group(feature)
+            self.options(feature)
+        self.bitmaps()
+        self.existing_dois(())
+        return self
+
+
+class MergedStudyData(StudyData):
+    """The studies of a StudyData `base` followed by submitted studies.
+
+    The base and its views are shared, not rebuilt. The submissions form a
+    small `delta` StudyData whose coded columns use the labels of `cube`:
+    the base's, then any values only submissions have. `cube` holds the
+    base's counts with the submissions applied one study at a time (see
+    `with_submissions`), so a new submission costs O(features^2) for the
+    counts plus indexing the submissions, however many studies the base
+    has. Searches are answered per segment; views over all studies (`df`,
+    `derived`, codes, row groups, bitmaps and sort keys) are put together
+    from the two segments on first use, copying arrays but computing
+    nothing again for the base.
+    """
+
+    def __init__(self, base, submitted, cube, changes_seq):
+        self.base = base
+        self.cube = cube
+        self.coded = base.coded
+        self.changes_seq = changes_seq
+        self.stamps = base.stamps
+        self.version = '{}-{}'.format(base.version, changes_seq)
+        self.checked_at = time.time()
+        self._labels = {feature: pd.Index(cube.labels[feature]) for feature in self.coded}
+        delta = fill_missing(submitted, base.df.columns).reset_index(drop=True)
+        delta = delta.astype({feature: pd.CategoricalDtype(self._labels[feature]) for feature in self.coded})
+        self.delta = StudyData(delta, version=self.version)
+        self._df = None
+        self._derived = None
+        self._codes = {}
+        self._records = None
+        self._ranks = {}
+        self._groups = {}
+        self._bitmaps = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            columns = {}
+            for col in self.base.df.columns:
+                if col in self.coded:
+                    columns[col] = pd.Categorical.from_codes(self.codes(col), dtype=self.delta.df[col].dtype)
+                else:
+                    columns[col] = pd.concat([self.base.df[col], self.delta.df[col]], ignore_index=True)
+            self._df = pd.DataFrame(columns)
+        return self._df
+
+    @property
+    def derived(self):
+        if self._derived is None:
+            self._derived = pd.concat([self.base.derived, self.delta.derived], ignore_index=True)
+        return self._derived
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def search(self, term):
+        return np.concatenate([self.base.search(term), self.delta.search(term)])
+
+    def labels(self, feature):
+        return self._labels[feature]
+
+    def existing_dois(self, dois):
+        return self.base.existing_dois(dois) | self.delta.existing_dois(dois)
+
+    def codes(self, feature, df=None):
+        if df is not None:
+            return StudyData.codes(self, feature, df)
+        if feature not in self._codes:
+            self._codes[feature] = np.concatenate([self.base.codes(feature), self.delta.codes(feature)])
+        return self._codes[feature]
+
+    def _group(self, feature):
+        if feature not in self._groups:
+            base, delta = self.base._group(feature), self.delta._group(feature)
+            empty = np.empty(0, dtype=np.int64)
+            self._groups[feature] = [np.concatenate([base[code] if code < len(base) else empty,
+                                                     rows + len(self.base)])
+                                     for code, rows in enumerate(delta)]
+        return self._groups[feature]
+
+    def bitmaps(self):
+        if self._bitmaps is None:
+            self._bitmaps = BitmapIndex.concat(self.base.bitmaps(), self.delta.bitmaps(), colnames)
+        return self._bitmaps
+
+    def rank(self, col):
+        if col not in self._ranks:
+            if col in self.coded:
+                # Labels that only submissions have come last, out of order
+                labels = np.asarray(self.labels(col), dtype=str)
+                order = np.empty(len(labels), dtype=np.int64)
+                order[np.argsort(labels, kind='mergesort')] = np.arange(len(labels))
+                codes = self.codes(col)
+                self._ranks[col] = np.where(codes >= 0, order[codes], -1)
+            else:
+                self._ranks[col] = merge_ranks(self.base.rank(col), self.base.df[col].values,
+                                               self.delta.df[col].values)
+        return self._ranks[col]
+
+
+# Seconds between checks of the study file for changes (0 disables watching)
+watch_interval = float(os.environ.get('RTFMRI_WATCH_INTERVAL', '5'))
+# Touching this file asks every process to reload the data (see request_reload)
+reload_trigger = os.path.join(cache.cache_dir, 'reload-request')
+
+_data = None
+_lock = threading.Lock()
+_watcher_pid = None
+_watcher_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def load(path=None):
+    """Build a new StudyData snapshot of the study file and the submissions.
+
+    The parsed frame comes from the binary cache when it matches the study
+    file (see datastore.cache), followed by any submitted studies; the
+    version is the file's SHA-1 prefix, plus the submission change sequence
+    if there are submissions.
+    """
+    # Taken first, so that a change made while loading is seen by the watcher
+    stamps = _stamps(path or filename)
+    df, digest = cache.load(path or filename, read_studies, cache_schema)
+    data = StudyData(df, version=digest[:12])
+    data.stamps = stamps
+    return with_submissions(data) if include_submissions else data
+
+
+def with_submissions(data):
+    """Snapshot of the curated studies of `data` plus the current submissions.
+
+    The curated studies' views are shared with `data`; only the submitted
+    studies are indexed again, and the counts are brought up to date by
+    applying the changes made since `data` to a copy of its cube. Returns
+    `data` itself when nothing changed.
+    """
+    from datastore import submissions
+    base = getattr(data, 'base', data)
+    since = data.changes_seq if data is not base else None
+    submitted, changes, changes_seq = submissions.snapshot(since)
+    if changes_seq == data.changes_seq:
+        return data
+    if since is None or changes_seq < since:
+        # Count the current submissions; the change log also has withdrawn
+        # ones, and starts over when the database does
+        cube = base.cube.copy()
+        for study in fill_missing(submitted, base.coded).to_dict('records'):
+            cube.add_study(study)
+    else:
+        cube = data.cube.copy()
+        for seq, op, study in changes:
+            study = {feature: 'DNR' if study.get(feature) is None else study[feature] for feature in base.coded}
+            if op == 'add':
+                cube.add_study(study)
+            else:
+                cube.remove_study(study)
+    return MergedStudyData(base, submitted, cube, changes_seq)
+
+
+def get():
+    """Return the current StudyData snapshot, loading it on first use.
+
+    Callbacks should call this once and use the returned snapshot
+    throughout, so that a reload happening meanwhile cannot mix versions.
+    Every `sync_interval` seconds this checks for submissions made by any
+    process, and if there are new ones starts a `refresh` in the background.
+    """
+    global _data
+    data = _data
+    if data is None:
+        with _lock:
+            if _data is None:
+                _data = load()
+            data = _data
+    if _watcher_pid != os.getpid():
+        start_watcher()
+    if include_submissions and time.time() - data.checked_at > sync_interval:
+        data.checked_at = time.time()
+        from datastore import submissions
+        if submissions.last_change() != data.changes_seq and _refresh_lock.acquire(False):
+            thread = threading.Thread(target=_refresh_quietly, name='study-data-refresh')
+            thread.daemon = True
+            thread.start()
+    return data
+
+
+def refresh():
+    """Swap in a snapshot with the submissions made since the current one.
+
+    Only the submissions are indexed again, and the counts updated one
+    change at a time (see `with_submissions`). Returns the current snapshot,
+    unchanged if submissions are not included in the data.
+    """
+    data = get()
+    if not include_submissions:
+        return data
+    with _lock:
+        return replace(with_submissions(_data))
+
+
+def _refresh_quietly():
+    try:
+        refresh()
+    except Exception:
+        # Keep serving the previous snapshot; the next check tries again
+        logging.getLogger(__name__).exception('Adding submissions failed')
+    finally:
+        _refresh_lock.release()
+
+
+def reload():
+    """Load the study data again and swap it in; returns the new snapshot.
+
+    The new snapshot is built completely before a single assignment makes
+    it current, so requests already working on the previous one finish on
+    it, and every later `get` sees the new one. Concurrent reloads queue.
+    """
+    with _lock:
+        return replace(load())
+
+
+def replace(data):
+    """Make `data` (a StudyData) the current snapshot; returns it.
+
+    Used by `reload`, and to run the app on other data, e.g. synthetic
+    datasets in the benchmarks.
+    """
+    global _data
+    _data = data
+    return data
+
+
+def request_reload():
+    """Reload in this process now, and ask all other processes to follow."""
+    # Touched under the reload lock, so this process's watcher either sees
+    # the trigger unchanged or stamped on the new snapshot
+    with _lock:
+        os.makedirs(os.path.dirname(reload_trigger), exist_ok=True)
+        with open(reload_trigger, 'a'):
+            os.utime(reload_trigger, None)
+        return replace(load())
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def _stamps(path=None):
+    return _stamp(path or filename), _stamp(reload_trigger)
+
+
+def _watch(interval):
+    # Compares the files with the stamps of the snapshot being served, so a
+    # process forked from one loaded before a change reloads too, and a
+    # reload done by this process is not repeated (both are checked under
+    # the reload lock, so one still in progress is waited for first)
+    pid = os.getpid()
+    failed = None
+    while True:
+        time.sleep(interval)
+        if _watcher_pid != pid:
+            return
+        with _lock:
+            data = _data
+            current = _stamps()
+            if data is None or data.stamps is None or current in (data.stamps, failed) or current[0] is None:
+                continue
+            try:
+                replace(load())
+            except Exception:
+                # Keep serving the previous snapshot, e.g. on a half-written
+                # file, until the file changes again
+                failed = current
+                logging.getLogger(__name__).exception('Reloading %s failed', filename)
+
+
+def start_watcher():
+    """Start the thread that reloads the data when the study file changes.
+
+    Threads do not survive a fork, so this is done once per process (it is
+    called from `get`); `watch_interval` 0 turns watching off.
+    """
+    global _watcher_pid
+    with _watcher_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+        if watch_interval <= 0:
+            return
+        thread = threading.Thread(target=_watch, args=(watch_interval,), name='study-data-watcher')
+        thread.daemon = True
+        thread.start()
+
+
+def stop_watcher():
+    """Stop this process's watcher thread (at its next check).
+
+    Forked children start their own on their next `get`.
+    """
+    global _watcher_pid
+    with _watcher_lock:
+        _watcher_pid = None
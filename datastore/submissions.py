@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+import pandas as pd
+from datastore import studies
+
+# Submissions live outside assets/ (which is served publicly) and outside git
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+db_path = os.environ.get('RTFMRI_SUBMISSIONS_DB', os.path.join(root_dir, 'instance', 'submissions.db'))
+
+# Study details entered on the Submit page, then one column per coded feature
+detail_columns = ['author', 'doi', 'title']
+columns = detail_columns + studies.features
+
+
+def _quote(name):
+    # 'or' (outlier removal) is an SQL keyword
+    return '"' + name + '"'
+
+
+# Every insert and delete is also appended to `changes`, whose newest
+# sequence number tells each process whether its snapshot is out of date
+# (see studies.get); `changes_since` lists what changed, which is applied to
+# the counts one study at a time. Deleted submissions are kept, marked by
+# deleted_at, so that their values can still be subtracted.
+schema = [
+    'CREATE TABLE IF NOT EXISTS submissions ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    " submitted_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),"
+    ' deleted_at TEXT,'
+    + ','.join(' {} TEXT'.format(_quote(col)) for col in columns) + ')',
+    'CREATE TABLE IF NOT EXISTS changes ('
+    ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' submission_id INTEGER NOT NULL,'
+    " op TEXT NOT NULL CHECK (op IN ('add', 'delete')))",
+    'CREATE INDEX IF NOT EXISTS submissions_doi ON submissions (doi)',
+    # DOIs are case-insensitive; see existing_dois
+    'CREATE INDEX IF NOT EXISTS submissions_doi_nocase ON submissions (doi COLLATE NOCASE)',
+] + [
+    'CREATE INDEX IF NOT EXISTS submissions_{0} ON submissions ({1})'.format(col, _quote(col))
+    for col in studies.features
+]
+
+# Connections by (process id, thread id, path)
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def connect(path=None):
+    """Connection for the current thread (and process), created on first use.
+
+    The database runs in WAL mode, so readers never block the writer and
+    gunicorn workers only queue briefly behind each other's (single row or
+    single batch) write transactions; busy_timeout makes them wait instead
+    of failing when they do.
+    """
+    path = path or db_path
+    key = (os.getpid(), threading.get_ident(), path)
+    conn = _connections.get(key)
+    if conn is None:
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # Only used by this thread, but close() may be called from another
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        # Databases created before the change log existed lack deleted_at
+        existing = [row[1] for row in conn.execute("PRAGMA table_info('submissions')")]
+        if existing and 'deleted_at' not in existing:
+            conn.execute('ALTER TABLE submissions ADD COLUMN deleted_at TEXT')
+        for statement in schema:
+            conn.execute(statement)
+        with _connections_lock:
+            # Connections are not carried over a fork (see close); forget the
+            # parent's ones, and close those of threads that have ended
+            alive = {thread.ident for thread in threading.enumerate()}
+            for other in [other for other in _connections if other[0] != key[0] or other[1] not in alive]:
+                stale = _connections.pop(other)
+                if other[0] == key[0]:
+                    stale.close()
+            _connections[key] = conn
+    return conn
+
+
+def close():
+    """Close this process's connections, e.g. before forking workers.
+
+    SQLite connections must not be used across a fork; a process that
+    opened one (like a preloading gunicorn master) closes it first, and
+    every process then opens its own on first use.
+    """
+    with _connections_lock:
+        for key in [key for key in _connections if key[0] == os.getpid()]:
+            _connections.pop(key).close()
+
+
+def field_value(value):
+    """Value as stored in the database (checklist codes joined by " + ")."""
+    if isinstance(value, (list, tuple)):
+        # Checklists (e.g. respiratory noise removal) allow several codes
+        return ' + '.join(str(val) for val in value) or None
+    if isinstance(value, str):
+        return value.strip() or None
+    return value
+
+
+def add_many(rows, path=None):
+    """Store several submissions in one transaction; returns their ids."""
+    conn = connect(path)
+    sql = 'INSERT INTO submissions ({}) VALUES ({})'.format(
+        ', '.join(_quote(col) for col in columns), ', '.join('?' * len(columns)))
+    ids = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for row in rows:
+            ids.append(conn.execute(sql, [field_value(row.get(col)) for col in columns]).lastrowid)
+        conn.executemany("INSERT INTO changes (submission_id, op) VALUES (?, 'add')", [(i,) for i in ids])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return ids
+
+
+def add(submission, path=None):
+    """Store one submission ({column: value}); returns its id."""
+    return add_many([submission], path)[0]
+
+
+def delete(submission_id, path=None):
+    """Withdraw a submission; returns False if there was no such submission."""
+    conn = connect(path)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.execute("UPDATE submissions SET deleted_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+                              ' WHERE id = ? AND deleted_at IS NULL', (submission_id,))
+        if cursor.rowcount:
+            conn.execute("INSERT INTO changes (submission_id, op) VALUES (?, 'delete')", (submission_id,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return bool(cursor.rowcount)
+
+
+def existing_dois(dois, path=None):
+    """Those of `dois` that current submissions have, lower-cased.
+
+    DOIs are compared without regard to case (and looked up in the DOI
+    index), as stored: `add_many` strips surrounding whitespace.
+    """
+    path = path or db_path
+    if not os.path.exists(path):
+        return set()
+    conn = connect(path)
+    dois = list(dois)
+    found = set()
+    # SQLite limits the number of parameters per statement
+    for start in range(0, len(dois), 500):
+        chunk = dois[start:start + 500]
+        sql = 'SELECT doi FROM submissions WHERE doi COLLATE NOCASE IN ({}) AND deleted_at IS NULL'.format(
+            ', '.join('?' * len(chunk)))
+        found.update(row[0].lower() for row in conn.execute(sql, chunk))
+    return found
+
+
+def read_frame(path=None, where=None, params=()):
+    """Current (not deleted) submissions as a DataFrame: id, timestamp, `columns`."""
+    path = path or db_path
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['id', 'submitted_at'] + columns)
+    sql = 'SELECT id, submitted_at, {} FROM submissions WHERE deleted_at IS NULL'.format(
+        ', '.join(_quote(col) for col in columns))
+    if where:
+        sql += ' AND (' + where + ')'
+    sql += ' ORDER BY id'
+    return pd.read_sql_query(sql, connect(path), params=params)
+
+
+def last_change(path=None):
+    """Sequence number of the newest change (0 if there are none)."""
+    path = path or db_path
+    if not os.path.exists(path):
+        return 0
+    return connect(path).execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+
+def snapshot(since=None, path=None):
+    """Current submissions, the changes after `since` (if given) and the
+    newest change's sequence number, read together (see `changes_since`)."""
+    path = path or db_path
+    if not os.path.exists(path):
+        return read_frame(path), [], 0
+    conn = connect(path)
+    conn.execute('BEGIN')
+    try:
+        seq = last_change(path)
+        changes = changes_since(since, path) if since is not None else []
+        frame = read_frame(path)
+    finally:
+        conn.execute('COMMIT')
+    return frame, changes, seq
+
+
+def changes_since(seq, path=None):
+    """Changes after `seq`, oldest first, as (seq, op, {column: value}) tuples."""
+    path = path or db_path
+    if not os.path.exists(path):
+        return []
+    sql = ('SELECT changes.seq, changes.op, {} FROM changes'
+           ' JOIN submissions ON submissions.id = changes.submission_id'
+           ' WHERE changes.seq > ? ORDER BY changes.seq').format(
+        ', '.join('submissions.' + _quote(col) for col in columns))
+    return [(row[0], row[1], dict(zip(columns, row[2:])))
+            for row in connect(path).execute(sql, (seq,))]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Synthetic study tables with the shape of the curated dataset, at any size.
+
+The coded features follow the value frequencies of the study file: the
+first feature is drawn from its counts, and every following one from its
+counts among the studies sharing the value drawn for the feature before it
+(the pairwise tables of CrosstabCube), so that neighbouring features such as
+vendor and field strength keep their co-occurrence. Authors combine the
+file's first-author surnames and publication years in their frequencies;
+DOIs are unique, under the 10.5555 test prefix.
+
+Write a table as TSV (in the app's format) and/or a binary format with:
+
+    python -m datastore.synthetic 100000 --seed 1 --output studies-100k.txt --formats tsv feather --cache
+
+and run the app on it with RTFMRI_STUDIES_FILE=studies-100k.txt; `--cache`
+prebuilds the app's binary cache for the TSV.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from datastore import cache, studies
+
+
+def _draw(rng, counts, size):
+    """`size` positions drawn with probabilities proportional to `counts`."""
+    cumulative = np.cumsum(counts, dtype=np.float64)
+    return np.searchsorted(cumulative, rng.random_sample(size) * cumulative[-1], side='right')
+
+
+def generate(rows, seed=0, source=None):
+    """DataFrame of `rows` synthetic studies, encoded like `read_studies` output.
+
+    The same `rows`, `seed` and source file always give the same table.
+    """
+    source = source or studies.filename
+    data = studies.StudyData(cache.load(source, studies.read_studies, studies.cache_schema)[0])
+    cube = data.cube
+    rng = np.random.RandomState(seed)
+    columns = {}
+
+    previous = None
+    for feature in cube.features:
+        codes = np.empty(rows, dtype=np.int64)
+        if previous is None:
+            codes[:] = _draw(rng, cube.counts[feature], rows)
+        else:
+            table = cube.table(previous, feature)
+            for position in range(table.shape[0]):
+                at = np.flatnonzero(columns[previous] == position)
+                counts = table[position] if table[position].any() else cube.counts[feature]
+                codes[at] = _draw(rng, counts, len(at))
+        columns[feature] = codes
+        previous = feature
+
+    surnames = data.derived['first_author'].value_counts()
+    years = data.derived['year'].dropna().astype(int).value_counts()
+    et_al = data.df['author'].str.contains('et al').mean()
+    author = np.asarray(surnames.index, dtype=object)[_draw(rng, surnames.values, rows)]
+    author = author + np.where(rng.random_sample(rows) < et_al, ' et al., (', ' (')
+    author = author + np.asarray(years.index.astype(str), dtype=object)[_draw(rng, years.values, rows)] + ')'
+
+    frame = {'author': author,
+             'doi': '10.5555/synthetic.{}.'.format(seed) + pd.Series(np.arange(rows)).astype(str).values}
+    for feature in cube.features:
+        # Values never drawn are left out, as parsing the TSV would
+        frame[feature] = pd.Categorical.from_codes(
+            columns[feature], categories=cube.labels[feature]).remove_unused_categories()
+    return pd.DataFrame(frame)[list(data.df.columns)]
+
+
+def write_tsv(df, path):
+    """Write a study table in the format of the study file (CR line ends)."""
+    lines = ['\t'.join(df.columns)]
+    lines.extend('\t'.join(row) for row in df.astype(str).values.tolist())
+    with open(path, 'w', newline='') as f:
+        f.write('\r'.join(lines))
+
+
+def main(argv=None):
+    formats = ['tsv', 'feather', 'pickle']
+    parser = argparse.ArgumentParser(description='Generate a synthetic study table.')
+    parser.add_argument('rows', type=int, help='number of studies')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', help='TSV path (default synthetic-<rows>.txt); binary formats replace '
+                                         'its extension')
+    parser.add_argument('--formats', nargs='+', choices=formats, default=['tsv'], help='formats to write')
+    parser.add_argument('--cache', action='store_true', help="also build the app's cache for the TSV")
+    args = parser.parse_args(argv)
+    if 'feather' in args.formats and cache.cache_format != 'feather':
+        parser.error('writing feather needs pyarrow')
+    if args.cache and 'tsv' not in args.formats:
+        parser.error('--cache needs the tsv format')
+
+    output = args.output or 'synthetic-{}.txt'.format(args.rows)
+    df = generate(args.rows, args.seed)
+    for fmt in args.formats:
+        if fmt == 'tsv':
+            path = output
+            write_tsv(df, path)
+        else:
+            path = os.path.splitext(output)[0] + '.' + fmt
+            cache.write_frame(df, path, fmt)
+        print('Wrote {} ({} studies)'.format(path, len(df)))
+    if args.cache:
+        cache.build(output, studies.read_studies, studies.cache_schema)
+        print('Wrote ' + cache.cache_paths(output)[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+from datastore import query
+
+# DataTable filter operators (dash-table 4.x syntax), longest spellings first
+# so that e.g. '>=' is not read as '>'
+operators = [
+    ('>=', ('>=', 'ge')),
+    ('<=', ('<=', 'le')),
+    ('!=', ('!=', 'ne')),
+    ('<', ('<', 'lt')),
+    ('>', ('>', 'gt')),
+    ('=', ('=', 'eq')),
+    ('contains', ('contains',)),
+    ('datestartswith', ('datestartswith',)),
+]
+
+
+def split_filter_part(filter_part):
+    """Split one `{column} operator value` clause of a DataTable filter_query.
+
+    Returns (column, operator, value), with the operator normalised to the
+    symbols in `operators`, or (None, None, None) if the clause is not
+    understood.
+    """
+    filter_part = filter_part.strip()
+    if not filter_part.startswith('{') or '}' not in filter_part:
+        return None, None, None
+    name_end = filter_part.index('}')
+    name = filter_part[1:name_end].strip()
+    rest = filter_part[name_end + 1:].strip()
+    for operator, spellings in operators:
+        for spelling in spellings:
+            if rest.lower().startswith(spelling) and (not spelling.isalpha() or rest[len(spelling):len(spelling) + 1] in ('', ' ')):
+                value = rest[len(spelling):].strip()
+                if len(value) > 1 and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+                    value = value[1:-1].replace('\\' + value[0], value[0])
+                return name, operator, value
+    return None, None, None
+
+
+def search_mask(data, input_value):
+    """Studies matching the Browse search box.
+
+    The input is a query such as `vendor=Siemens AND mc=Y` (see
+    datastore.query) if it parses as one, and a search term otherwise.
+    """
+    if query.is_query(input_value):
+        try:
+            return query.mask(data, input_value)
+        except query.QueryError:
+            pass
+    return data.search(input_value)
+
+
+def filter_mask(data, filter_query, mask=None):
+    """Apply a DataTable filter_query to the studies in `data`.
+
+    Clauses are and-ed (' && '), as produced by the column filter row.
+    Equality on coded columns goes through the integer codes; the other
+    comparisons work on the string values. `mask` optionally restricts the
+    result further (e.g. to the rows matching the search box).
+    """
+    if mask is None:
+        mask = np.ones(len(data), dtype=bool)
+    if not filter_query:
+        return mask
+    for filter_part in filter_query.split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name not in data.df.columns:
+            continue
+        if operator in ('=', '!=') and col_name in data.coded:
+            part = data.mask(col_name, value)
+        else:
+            values = data.df[col_name].astype(str).values
+            if operator == 'contains':
+                part = np.array([value in val for val in values], dtype=bool)
+            elif operator == 'datestartswith':
+                part = np.array([val.startswith(value) for val in values], dtype=bool)
+            elif operator in ('=', '!='):
+                part = values == value
+            elif operator == '<':
+                part = values < value
+            elif operator == '<=':
+                part = values <= value
+            elif operator == '>':
+                part = values > value
+            else:
+                part = values >= value
+        if operator == '!=':
+            part = ~part
+        mask = mask & part
+    return mask
+
+
+def sort_rows(data, rows, sort_by):
+    """Order row positions by a DataTable sort_by list (first key wins)."""
+    if not sort_by:
+        return rows
+    keys = []
+    for col in reversed(sort_by):
+        rank = data.rank(col['column_id'])[rows]
+        keys.append(rank if col['direction'] == 'asc' else -rank)
+    return rows[np.lexsort(keys)]
+
+
+def page(rows, page_current, page_size):
+    """Row positions on one page and the total number of pages."""
+    page_current = page_current or 0
+    page_count = max(int(math.ceil(len(rows) / float(page_size))), 1)
+    start = min(page_current, page_count - 1) * page_size
+    return rows[start:start + page_size], page_count
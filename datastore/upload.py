@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Batch submissions from a TSV or CSV file in the schema of the study file.
+
+The file needs the study file's columns (author, the coded features and
+doi; an optional title column is stored too). All rows are checked column
+by column, with vectorized operations:
+
+- author and doi are required, the DOI must look like one (10.xxxx/...) and
+  be new: not in the dataset or the submissions, and not repeated in the
+  file;
+- every coded feature must hold one of the values offered on the Submit
+  page (any case), or for respiratory noise removal several of them joined
+  by ' + '.
+
+The valid rows are stored together in one transaction; the others are
+reported with their line numbers.
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+from datastore import studies, submissions
+
+required_columns = ['author'] + studies.features + ['doi']
+
+# Features whose values may combine several codes (a checklist on the Submit page)
+multi_value_features = ['resp']
+
+doi_pattern = r'^10\.\d{4,9}/\S+$'
+
+# Largest file (in bytes) and number of studies accepted in one upload
+max_upload_bytes = int(float(os.environ.get('RTFMRI_MAX_UPLOAD_MB', '10')) * 1024 * 1024)
+max_upload_rows = int(os.environ.get('RTFMRI_MAX_UPLOAD_ROWS', '10000'))
+
+
+class UploadError(ValueError):
+    """A file that cannot be read as a table of studies."""
+
+
+def read_table(content, filename=''):
+    """DataFrame of strings from the bytes of a TSV or CSV file.
+
+    Tabs in the header line mean TSV. Line ends may be CR (as in the study
+    file), LF or CRLF. Files over `max_upload_bytes` or `max_upload_rows`
+    are refused.
+    """
+    if len(content) > max_upload_bytes:
+        raise UploadError('The file is larger than {:.0f} MB'.format(max_upload_bytes / 1024. / 1024.))
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise UploadError('The file is not UTF-8 text')
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    header = text.split('\n', 1)[0]
+    sep = '\t' if '\t' in header or filename.lower().endswith(('.tsv', '.txt')) else ','
+    try:
+        df = pd.read_csv(io.StringIO(text), sep=sep, dtype=str, keep_default_na=False, skip_blank_lines=True)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise UploadError('The file could not be parsed: {}'.format(e))
+    df.columns = [str(col).strip() for col in df.columns]
+    missing = [col for col in required_columns if col not in df.columns]
+    if missing:
+        raise UploadError('Missing columns: {}'.format(', '.join(missing)))
+    if len(df) > max_upload_rows:
+        raise UploadError('The file has {} studies, at most {} can be uploaded at once'.format(
+            len(df), max_upload_rows))
+    return df
+
+
+def vocabularies(data):
+    """Allowed values per coded feature, by upper case spelling.
+
+    The values offered by the Submit page's dropdowns (StudyData.options).
+    """
+    return {feature: {option['value'].upper(): option['value'] for option in data.options(feature)}
+            for feature in studies.features if feature in data.coded}
+
+
+def _canonical(values, vocabulary, multi=False):
+    # Values spelled as in the vocabulary, NaN where not allowed
+    canonical = values.str.upper().map(vocabulary)
+    if multi:
+        retry = canonical.isna() & values.str.contains(' + ', regex=False)
+        if retry.any():
+            parts = values[retry].str.upper().str.split(r' \+ ').explode().str.strip()
+            mapped = parts.map(vocabulary)
+            valid = mapped.notna().groupby(level=0).all()
+            joined = mapped.groupby(level=0).agg(lambda part: ' + '.join(part.dropna()))
+            canonical[retry] = joined.where(valid)
+    return canonical
+
+
+def validate(df, data):
+    """Check a table of submissions against a StudyData snapshot.
+
+    Returns the valid rows as {column: value} dicts (codes spelled as in
+    the vocabularies) and the errors as {'line', 'column', 'value',
+    'message'} dicts, `line` counting the header as line 1.
+    """
+    df = df.apply(lambda col: col.str.strip())
+    invalid = np.zeros(len(df), dtype=bool)
+    errors = []
+
+    def fail(bad, column, message):
+        for i in np.flatnonzero(bad.values):
+            errors.append({'line': int(i) + 2, 'column': column, 'value': df[column].iat[i], 'message': message})
+        invalid[bad.values] = True
+
+    for column in ('author', 'doi'):
+        fail(df[column] == '', column, 'required')
+    doi = df['doi']
+    present = doi != ''
+    fail(present & ~doi.str.match(doi_pattern), 'doi', 'not a DOI (10.xxxx/...)')
+    # Compared stripped and lower-cased on both sides, like the uploaded values
+    key = doi.str.lower()
+    candidates = key[present].unique()
+    known = data.existing_dois(candidates) | submissions.existing_dois(candidates)
+    fail(present & key.isin(known), 'doi', 'already in the dataset')
+    fail(present & key.duplicated(), 'doi', 'repeated in the file')
+
+    records = df.reindex(columns=submissions.columns).astype(object)
+    records = records.where(records.notna(), None)
+    for feature, vocabulary in vocabularies(data).items():
+        values = df[feature]
+        canonical = _canonical(values, vocabulary, feature in multi_value_features)
+        fail(values == '', feature, 'required')
+        fail((values != '') & canonical.isna(), feature, 'not one of the allowed values')
+        records[feature] = canonical
+
+    errors.sort(key=lambda error: error['line'])
+    valid = records[~invalid]
+    return valid.to_dict('records'), errors
+
+
+def ingest(content, filename='', data=None):
+    """Validate an uploaded file and store its valid rows.
+
+    Returns {'rows', 'stored', 'ids', 'errors'}; raises UploadError when the
+    file cannot be read at all.
+    """
+    if data is None:
+        data = studies.get()
+    df = read_table(content, filename)
+    rows, errors = validate(df, data)
+    ids = submissions.add_many(rows) if rows else []
+    if ids:
+        # Show the new studies right away in this process (others pick them up within sync_interval)
+        studies.refresh()
+    return {'rows': len(df), 'stored': len(ids), 'ids': ids, 'errors': errors}
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""gunicorn settings for serving the app with the data loaded once.
+
+    gunicorn -c gunicorn.conf.py index:server
+
+With `preload_app` the master imports the app, and then (in `when_ready`)
+parses the study data and builds the search index, crosstab cube, table
+rows and page layouts, before forking the workers. The workers then share
+those pages copy-on-write with the master instead of each building (and
+holding) a copy of their own. Memory only gets duplicated where a worker
+writes to it: `gc.freeze()` keeps the garbage collector from doing so to
+every preloaded object, and the large views are numpy arrays, which reading
+does not touch.
+
+A worker that reloads the data (see datastore.studies.reload) holds the new
+version privately; restart the server to share it again. Measure per-worker
+memory with `python benchmarks/worker_memory.py`.
+
+Settings can be overridden on the command line or through the environment:
+PORT, WEB_CONCURRENCY (number of workers) and GUNICORN_PRELOAD=0 to start
+every worker from scratch instead.
+"""
+import gc
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8050')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # The app has been imported (when preloading), and no worker forked yet
+    if not preload_app:
+        return
+    import index
+    from datastore import studies, submissions
+    data = studies.get().warm()
+    for pathname in index.routes:
+        index.page_layout(pathname)
+    # The master does not serve requests; workers run their own watcher and
+    # open their own database connections (SQLite's must not cross a fork)
+    studies.stop_watcher()
+    submissions.close()
+    gc.collect()
+    if hasattr(gc, 'freeze'):  # Python 3.7+
+        gc.freeze()
+    server.log.info('Preloaded study data version %s', data.version)
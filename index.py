@@ -3,11 +3,77 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from app import app, server
-from pages import home, page1, page2, page3, page4
+from datastore import studies, upload
+from datastore.memo import memoize
+from api import admin, rest, uploads
+import importlib
+import threading
 import flask
 
 
+# Pages by URL path: the module under pages/ that provides its `layout`,
+# either a component or a function of the StudyData snapshot. Modules are
+# imported on first use, and layouts built once per data version.
+routes = {
+    '/': 'home',
+    '/pages/page1': 'page1',
+    '/pages/page2': 'page2',
+    '/pages/page3': 'page3',
+    '/pages/page4': 'page4',
+}
+
+_import_lock = threading.RLock()
+
+
+def page_module(pathname):
+    """The page module serving `pathname` (imported if need be), or None."""
+    name = routes.get(pathname)
+    if name is None:
+        return None
+    with _import_lock:
+        return importlib.import_module('pages.' + name)
+
+
+def import_pages():
+    """Import every page, and so register all of their callbacks."""
+    for pathname in routes:
+        page_module(pathname)
+
+
+def page_layout(pathname):
+    """Layout of the page at `pathname`, or None for unknown paths."""
+    module = page_module(pathname)
+    if module is None:
+        return None
+    if not callable(module.layout):
+        return module.layout
+    return build_layout(studies.get(), pathname)
+
+
+@memoize(maxsize=32)
+def build_layout(data, pathname):
+    return page_module(pathname).layout(data)
+
+
+not_found_layout = html.Div([
+    html.H2('Page not found',
+    style={
+        'textAlign': 'center',
+        'marginBottom': 25,
+        'marginTop': 25,
+    }),
+    dcc.Markdown('There is no page at this address. [Return to the home page](/).'),
+],
+style={
+    'marginBottom': 25,
+    'marginTop': 25,
+    'marginLeft': '5%',
+    'maxWidth': '90%',
+})
+
+
 nav_item1 = dbc.NavItem(dbc.NavLink("Browse", href="/pages/page1", external_link=True))
 nav_item2 = dbc.NavItem(dbc.NavLink("Visualize", href="/pages/page2", external_link=True))
 nav_item3 = dbc.NavItem(dbc.NavLink("Submit", href="/pages/page3", external_link=True))
@@ -50,21 +116,53 @@ nav_bar_and_content_div = html.Div(children=[
 
 )
 
+_validation_layout = None
+
+
+def validation_layout():
+    """Skeleton of all pages for validating callbacks, without any data.
+
+    Holds an empty component of the declared type for every id in the page
+    modules' `component_ids`, instead of the pages' actual layouts.
+    """
+    global _validation_layout
+    if _validation_layout is None:
+        # Importing the pages registers their callbacks, which asks Dash for
+        # the layout again; it gets the navigation bar until this is done
+        _validation_layout = nav_bar_and_content_div
+        skeleton = [nav_bar_and_content_div]
+        for pathname in routes:
+            component_ids = getattr(page_module(pathname), 'component_ids', {})
+            skeleton.append(html.Div([component(id=component_id)
+                                      for component_id, component in component_ids.items()]))
+        _validation_layout = html.Div(skeleton)
+    return _validation_layout
+
+
 def serve_layout():
     if flask.has_request_context():
         return nav_bar_and_content_div
-    return html.Div([
-        nav_bar_and_content_div,
-        home.layout,
-        page1.layout,
-        page2.layout,
-        page3.layout,
-        page4.layout,
-    ])
+    return validation_layout()
 
 
 app.layout = serve_layout
 
+server.register_blueprint(admin.blueprint)
+server.register_blueprint(rest.blueprint)
+server.register_blueprint(uploads.blueprint)
+# Refuse larger requests before reading them: uploads, which come through
+# the Dash callback as base64 (4/3 of the file's size), plus some margin
+server.config['MAX_CONTENT_LENGTH'] = 2 * upload.max_upload_bytes
+
+
+@server.before_request
+def register_page_callbacks():
+    # Dash serves the callback list to the browser, and dispatches callback
+    # requests, from the callbacks registered at that point; a page's are
+    # registered when its module is imported
+    if flask.request.path.startswith(app.config.routes_pathname_prefix + '_dash-'):
+        import_pages()
+
 
 
 ###########################
@@ -88,23 +186,14 @@ def toggle_navbar_collapse(n, is_open): # we use a callback to toggle the collap
      Output('logo', 'src')],
     [Input('url', 'pathname')])
 def display_page(pathname):
-    if pathname == '/':
-        logo_url = 'assets/logo_jsheunis_3.jpeg'
-        return [home.layout, logo_url]
-    elif pathname == '/pages/page1':
-        logo_url = '../assets/logo_jsheunis_3.jpeg'
-        return [page1.layout, logo_url]
-    elif pathname == '/pages/page2':
-        logo_url = '../assets/logo_jsheunis_3.jpeg'
-        return [page2.layout, logo_url]
-    elif pathname == '/pages/page3':
-        logo_url = '../assets/logo_jsheunis_3.jpeg'
-        return [page3.layout, logo_url]
-    elif pathname == '/pages/page4':
-        logo_url = '../assets/logo_jsheunis_3.jpeg'
-        return [page4.layout, logo_url]
-    else:
-        return '404'
+    if pathname is None:
+        raise PreventUpdate
+    # The logo is linked relative to the page's path
+    logo_url = '../' * (pathname.count('/') - 1) + 'assets/logo_jsheunis_3.jpeg'
+    layout = page_layout(pathname)
+    if layout is None:
+        return [not_found_layout, logo_url]
+    return [layout, logo_url]
 
 
 
@@ -3,157 +3,184 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
 from dash.dependencies import Input, Output
-import pandas as pd
 import numpy as np
 from app import app
+from api import rest
+from datastore import studies, tablequery
 
-# Get data
-filename = 'assets/rtfMRI_methods_review_included_studies_procsteps.txt'
-df_studies = pd.read_csv(filename, sep='\t', lineterminator='\r')
-df_studies = df_studies.dropna(axis='columns')
-df_plot = df_studies.copy()
-
-colnames = {
-    'author':'Author',
-    'vendor': 'Vendor',
-    'magnet': 'Field strength',
-    'software': 'Software',
-    'stc': 'Slice time correction',
-    'mc': '3D volume realignment',
-    'ss': 'Spatial smoothing',
-    'dr': 'Drift removal',
-    'hmp': 'Realignment parameter regression',
-    'ts': 'Temporal smoothing',
-    'ff': 'Frequency filtering',
-    'or': 'Outlier removal',
-    'droi': 'Differential ROI',
-    'resp': 'Respiratory noise removal',
-    'doi': 'Article DOI'
+colnames = studies.colnames
+
+# Components used by the callbacks below, by id (see index.validation_layout)
+component_ids = {
+    'my-id': dcc.Input,
+    'table': dash_table.DataTable,
+    'table-download': html.Div,
 }
 
-plotnames = [
-    {'label': 'Vendor', 'value': 'vendor'},
-    {'label': 'Field strength', 'value': 'magnet'},
-    {'label': 'Software', 'value': 'software'},
-    {'label': 'Slice time correction', 'value': 'stc'},
-    {'label': '3D volume realignment', 'value': 'mc'},
-    {'label': 'Spatial smoothing', 'value': 'ss'},
-    {'label': 'Drift removal', 'value': 'dr'},
-    {'label': 'Realignment parameter regression', 'value': 'hmp'},
-    {'label': 'Temporal smoothing', 'value': 'ts'},
-    {'label': 'Frequency filtering', 'value': 'ff'},
-    {'label': 'Outlier removal', 'value': 'or'},
-    {'label': 'Differential ROI', 'value': 'droi'},
-    {'label': 'Respiratory noise removal', 'value': 'resp'},
-]
-
-# Replace 'doi' column values with markdown link to actual doi
-for index, row in df_studies.iterrows():
-    doi = row['doi']
-    doi_link = '[' + doi + ']' + '(https://doi.org/' + doi + ')'
-    row['doi'] = doi_link
+# Rows per page of the Browse table; paging, filtering and sorting all run
+# on the server so only the current page is ever sent to the browser
+page_size = 20
+
 
+def table_page(data, input_value='', page_current=0, page_size=page_size, filter_query='', sort_by=None):
+    rows = np.flatnonzero(tablequery.filter_mask(data, filter_query, tablequery.search_mask(data, input_value)))
+    rows = tablequery.sort_rows(data, rows, sort_by)
+    rows, page_count = tablequery.page(rows, page_current, page_size)
+    return data.records(rows), page_count
 
 
 main_md = dcc.Markdown('''
 
 The table below contains a list of 128 real-time fMRI neurofeedback studies coded for standard quality control and denoising processing steps.
 This section allows you to filter through these studies to find what you are looking for. You can click on the `DOI` link to view the article online.
+Besides a search term, the search box takes queries over the coded methods, such as `vendor=Siemens AND mc=Y AND (ss=4MM OR ss=6MM)`.
 For more background and information on how this coded data were generated,see the [preprint](https://osf.io/xubhq/)
 and [Github repository](https://github.com/jsheunis/quality-and-denoising-in-rtfmri-nf) of this work.    
 
 ''')
 
 
-layout = html.Div([
-            html.Div(
-                html.H2('Browse'),
-                style={
-                    'marginBottom': 25,
-                    'marginTop': 25,
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                    'textAlign': 'center'
-                }
-            ),
-            html.Div(
-                main_md,
-                style={
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                }
-            ),
-            html.Br([]),
-            html.Div([
-                dcc.Input(id='my-id', value='', type='text',
-                    placeholder='Enter a search term...',
+def download_links(input_value='', filter_query='', sort_by=None):
+    # Links to streamed exports of the studies matching the search, filter and sort
+    sort = ','.join(('-' if col['direction'] == 'desc' else '') + col['column_id'] for col in sort_by or [])
+    links = [html.A(label, href=rest.export_url(fmt, search=input_value, filter=filter_query, sort=sort),
+                    className='ml-2')
+             for fmt, label in rest.export_formats.items()]
+    return ['Download these studies as'] + links
+
+
+def layout(data):
+    """Browse page for a StudyData snapshot, showing the first table page."""
+    first_page, first_page_count = table_page(data)
+    return html.Div([
+                html.Div(
+                    html.H2('Browse'),
+                    style={
+                        'marginBottom': 25,
+                        'marginTop': 25,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                        'textAlign': 'center'
+                    }
+                ),
+                html.Div(
+                    main_md,
+                    style={
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                    }
+                ),
+                html.Br([]),
+                html.Div([
+                    dcc.Input(id='my-id', value='', type='text',
+                        placeholder='Enter a search term or a query, e.g. vendor=Siemens AND mc=Y',
+                        style={
+                            'marginBottom': 0,
+                            'marginTop': 0,
+                            'width': '40%',
+                        }
+                    )],
+                    style={
+                        'marginBottom': 25,
+                        'marginTop': 25,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                        'textAlign': 'center'
+                    }
+                ),
+
+                dash_table.DataTable(
+                    id='table',
+                    columns=[{"name": colnames[i], "id": i, "presentation": "markdown"} for i in data.df.columns],
+                    data=first_page,
+                    style_table={
+                        # 'overflowX': 'scroll',
+                                 'marginLeft': '5%',
+                                 'maxWidth': '90%',},
+                    fixed_columns={ 'headers': True, 'data': 0 },
+                    style_header={
+                        'textAlign': 'center',
+                        'backgroundColor': '#EBEDEF',
+                        'fontWeight': 'bold',
+                        # 'textAlign': 'right',
+                    },
+                    style_cell={
+                        'height': 'auto',
+                        # 'minWidth': '0px', 'maxWidth': '150px',
+                        'whiteSpace': 'normal',
+                        'padding': '4px',
+                        'fontSize': '12px',
+                        'textAlign': 'left',
+                        'fontFamily': 'Trebuchet MS',
+
+                        # all three widths are needed
+                        'minWidth': '70px', 'width': '70px', 'maxWidth': '70px',
+                        'overflow': 'hidden',
+                        'textOverflow': 'ellipsis',
+                    },
+                    style_cell_conditional=[
+                        {'if': {'column_id': 'author'},
+                         'minWidth': '130px', 'width': '130px', 'maxWidth': '130px'},
+                        {'if': {'column_id': 'doi'},
+                         'minWidth': '130px', 'width': '130px', 'maxWidth': '130px' },
+                    ],
+                    page_action="custom",
+                    page_current=0,
+                    page_size=page_size,
+                    page_count=first_page_count,
+                    filter_action="custom",
+                    filter_query='',
+                    sort_action="custom",
+                    sort_mode="multi",
+                    sort_by=[],
+                    # css= [{'selector': 'table', 'rule': 'table-layout: fixed;'}]
+                ),
+                html.Div(
+                    id='table-download',
+                    children=download_links(),
                     style={
-                        'marginBottom': 0,
-                        'marginTop': 0,
-                        'width': '40%',
+                        'marginTop': 10,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
                     }
-                )],
-                style={
-                    'marginBottom': 25,
-                    'marginTop': 25,
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                    'textAlign': 'center'
-                }
-            ),
-
-            dash_table.DataTable(
-                id='table',
-                columns=[{"name": colnames[i], "id": i, "presentation": "markdown"} for i in df_studies.columns],
-                data=df_studies.to_dict('records'),
-                style_table={
-                    # 'overflowX': 'scroll',
-                             'marginLeft': '5%',
-                             'maxWidth': '90%',},
-                fixed_columns={ 'headers': True, 'data': 0 },
-                style_header={
-                    'textAlign': 'center',
-                    'backgroundColor': '#EBEDEF',
-                    'fontWeight': 'bold',
-                    # 'textAlign': 'right',
-                },
-                style_cell={
-                    'height': 'auto',
-                    # 'minWidth': '0px', 'maxWidth': '150px',
-                    'whiteSpace': 'normal',
-                    'padding': '4px',
-                    'fontSize': '12px',
-                    'textAlign': 'left',
-                    'fontFamily': 'Trebuchet MS',
-
-                    # all three widths are needed
-                    'minWidth': '70px', 'width': '70px', 'maxWidth': '70px',
-                    'overflow': 'hidden',
-                    'textOverflow': 'ellipsis',
-                },
-                style_cell_conditional=[
-                    {'if': {'column_id': 'author'},
-                     'minWidth': '130px', 'width': '130px', 'maxWidth': '130px'},
-                    {'if': {'column_id': 'doi'},
-                     'minWidth': '130px', 'width': '130px', 'maxWidth': '130px' },
-                ],
-                filter_action="native",
-                sort_action="native",
-                sort_mode="multi",
-                # css= [{'selector': 'table', 'rule': 'table-layout: fixed;'}]
-            )
-])
-
-
-# Callback for table search function
+                ),
+    ])
+
+
+# Callback for table search function, paging, filtering and sorting
+@app.callback(
+    [Output('table', 'data'),
+     Output('table', 'page_count')],
+    [Input(component_id='my-id', component_property='value'),
+     Input('table', 'page_current'),
+     Input('table', 'page_size'),
+     Input('table', 'filter_query'),
+     Input('table', 'sort_by')]
+)
+def update_output_div(input_value, page_current, page_size, filter_query, sort_by):
+
+    data = studies.get()
+    records, page_count = table_page(data, input_value, page_current, page_size, filter_query, sort_by)
+
+    return [records, page_count]
+
+
+# Go back to the first page when the set of matching studies changes
 @app.callback(
-    Output('table', 'data'),
-    [Input(component_id='my-id', component_property='value')]
+    Output('table', 'page_current'),
+    [Input(component_id='my-id', component_property='value'),
+     Input('table', 'filter_query')]
 )
-def update_output_div(input_value):
+def reset_page(input_value, filter_query):
+    return 0
 
-    mask = np.column_stack([df_studies[col].str.contains(input_value, case=False, regex=False, na=False) for col in df_studies])
-    df = df_studies.loc[mask.any(axis=1)]
-    data = df.to_dict('records')
 
-    return data
+# Keep the download links in step with the table's selection and order
+@app.callback(
+    Output('table-download', 'children'),
+    [Input(component_id='my-id', component_property='value'),
+     Input('table', 'filter_query'),
+     Input('table', 'sort_by')]
+)
+def update_download(input_value, filter_query, sort_by):
+    return download_links(input_value, filter_query, sort_by)
@@ -1,60 +1,50 @@
 # -*- coding: utf-8 -*-
+import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
-import pandas as pd
 from app import app
-
-# Get data
-filename = 'assets/rtfMRI_methods_review_included_studies_procsteps.txt'
-df_studies = pd.read_csv(filename, sep='\t', lineterminator='\r')
-df_studies = df_studies.dropna(axis='columns')
-df_plot = df_studies.copy()
-
-colnames = {
-    'author':'Author',
-    'vendor': 'Vendor',
-    'magnet': 'Field strength',
-    'software': 'Software',
-    'stc': 'Slice time correction',
-    'mc': '3D volume realignment',
-    'ss': 'Spatial smoothing',
-    'dr': 'Drift removal',
-    'hmp': 'Realignment parameter regression',
-    'ts': 'Temporal smoothing',
-    'ff': 'Frequency filtering',
-    'or': 'Outlier removal',
-    'droi': 'Differential ROI',
-    'resp': 'Respiratory noise removal',
-    'doi': 'Article DOI'
+from api import rest
+from datastore import aggregates, query, studies
+from datastore.memo import memoize
+
+colnames = studies.colnames
+plotnames = studies.plotnames
+
+# Components used by the callbacks below, by id (see index.validation_layout)
+component_ids = {
+    'drop-1': dcc.Dropdown,
+    'drop-2': dcc.Dropdown,
+    'graph-1-title': html.H6,
+    'graph-2-title': html.H6,
+    'graph-1': dcc.Graph,
+    'graph-2': dcc.Graph,
+    'crosstab-store': dcc.Store,
+    'query-1': dcc.Input,
+    'table-1': html.Div,
+    'table-1-prev': dbc.Button,
+    'table-1-next': dbc.Button,
+    'table-1-pager': html.Div,
+    'table-1-page': dcc.Store,
+    'table-1-download': html.Div,
+    'drill-path': dcc.Dropdown,
+    'drill-kind': dcc.RadioItems,
+    'drill-graph': dcc.Graph,
 }
 
-plotnames = [
-    {'label': 'Vendor', 'value': 'vendor'},
-    {'label': 'Field strength', 'value': 'magnet'},
-    {'label': 'Software', 'value': 'software'},
-    {'label': 'Slice time correction', 'value': 'stc'},
-    {'label': '3D volume realignment', 'value': 'mc'},
-    {'label': 'Spatial smoothing', 'value': 'ss'},
-    {'label': 'Drift removal', 'value': 'dr'},
-    {'label': 'Realignment parameter regression', 'value': 'hmp'},
-    {'label': 'Temporal smoothing', 'value': 'ts'},
-    {'label': 'Frequency filtering', 'value': 'ff'},
-    {'label': 'Outlier removal', 'value': 'or'},
-    {'label': 'Differential ROI', 'value': 'droi'},
-    {'label': 'Respiratory noise removal', 'value': 'resp'},
-]
-
-srs = df_plot['vendor'].value_counts()
-xx = srs.index.to_list()
-yy = srs.values
-
-dataframe = df_plot.loc[df_plot['vendor'] == 'Siemens']
-srs2 = dataframe['magnet'].value_counts()
-xx2 = srs2.index.to_list()
-yy2 = srs2.values
+# Studies per page of the table shown after clicking a bar in graph-1
+table_page_size = 20
+
+# Features of the drill-down chart when the page opens, outermost first
+drill_path = ['vendor', 'software', 'mc', 'ss']
+
+# Compact count tables shipped to the browser once, so that hovering over
+# graph-1 updates graph-2 clientside (see assets/clientside.js)
+def crosstab_data(data):
+    return dict(data.cube.to_dict(), version=data.version,
+                names={key: colnames[key] for key in data.cube.features})
 
 
 main_md = dcc.Markdown('''
@@ -65,115 +55,189 @@ There are two plots below, for which you can display data of a method selected f
 Say you want to view the distribution of scanner vendors used in these studies, select the `Vendor` option for the plot on the left hand side.
 You can then *hover* over each of the bars in the plot to see the actual number of studies per vendor, e.g. 18 studies used a Philips scanner.
 You can also *click* on the bar to display these specific studies in a table below the plots.
+To list only some of them, enter a query over the other methods above the table, e.g. `mc = Y AND (ss = 4MM OR ss = 6MM)`.
 
 Say, now, that you want to see which software packages were used for each of the vendors, select the `Software` option for the plot on the right hand side.
 By hovering over each bar on the `Vendor` plot, the `Software` plot will update with the relevant distribution.       
 
+Further down, the drill-down chart breaks the studies down by several methods in turn, e.g. vendor, then software, then realignment, then smoothing.
+Choose the methods and their order in the dropdown, and click a segment to zoom into it.
+
 ''')
 
-layout = html.Div([
-            html.Div([
-                html.H2('Visualize'),
-                ],
-                style={
-                    'marginBottom': 25,
-                    'marginTop': 25,
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                    'textAlign': 'center'
-                }
-            ),
-            html.Div(main_md,
-                style={
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                }
-            ),
-            html.Br([]),
-            html.Div(
-                [
-                    dbc.Row(
-                        [
-                            dbc.Col(dcc.Dropdown(
-                                id='drop-1',
-                                options=plotnames,
-                                value='vendor',
+def layout(data):
+    """Visualize page for a StudyData snapshot (vendor counts, magnet by vendor)."""
+    srs = data.cube.value_counts('vendor')
+    xx = srs.index.to_list()
+    yy = srs.values
+    srs2 = data.cube.crosstab('vendor', 'Siemens', 'magnet')
+    xx2 = srs2.index.to_list()
+    yy2 = srs2.values
+
+    return html.Div([
+                html.Div([
+                    html.H2('Visualize'),
+                    ],
+                    style={
+                        'marginBottom': 25,
+                        'marginTop': 25,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                        'textAlign': 'center'
+                    }
+                ),
+                html.Div(main_md,
+                    style={
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                    }
+                ),
+                html.Br([]),
+                html.Div(
+                    [
+                        dbc.Row(
+                            [
+                                dbc.Col(dcc.Dropdown(
+                                    id='drop-1',
+                                    options=plotnames,
+                                    value='vendor',
+                                    ),
+                                    width={"size": 4, "offset": 1}, # figure out offset
                                 ),
-                                width={"size": 4, "offset": 1}, # figure out offset
-                            ),
-                            dbc.Col(dcc.Dropdown(
-                                id='drop-2',
-                                options=plotnames,
-                                value='vendor',
+                                dbc.Col(dcc.Dropdown(
+                                    id='drop-2',
+                                    options=plotnames,
+                                    value='vendor',
+                                    ),
+                                    width={"size": 4, "offset": 2},
                                 ),
-                                width={"size": 4, "offset": 2},
-                            ),
-                        ],
-                        justify="start"
-                    ),
-                    html.Br([]),
-                    dbc.Row(
-                        [
-                            dbc.Col(html.H6(
-                                id='graph-1-title',
-                                children='Vendor (hover to show options of second feature; click to display studies)',
-                                style={
-                                    'textAlign': 'center',
-                                }),
-                                # width={"size": 6, "offset": 3}
-                            ),
-                            dbc.Col(html.H6(
-                                id='graph-2-title',
-                                children='Field strength options when Vendor = Siemens',
-                                style={
-                                    'textAlign': 'center',
-                                }),
-                                # width={"size": 6, "offset": 3}
-                            )
-                        ]
+                            ],
+                            justify="start"
+                        ),
+                        html.Br([]),
+                        dbc.Row(
+                            [
+                                dbc.Col(html.H6(
+                                    id='graph-1-title',
+                                    children='Vendor (hover to show options of second feature; click to display studies)',
+                                    style={
+                                        'textAlign': 'center',
+                                    }),
+                                    # width={"size": 6, "offset": 3}
+                                ),
+                                dbc.Col(html.H6(
+                                    id='graph-2-title',
+                                    children='Field strength options when Vendor = Siemens',
+                                    style={
+                                        'textAlign': 'center',
+                                    }),
+                                    # width={"size": 6, "offset": 3}
+                                )
+                            ]
+                        ),
+                        dbc.Row(
+                            [
+                                dbc.Col(html.Div(
+                                    dcc.Graph(
+                                        id='graph-1',
+                                        figure={
+                                            'data': [
+                                                {'x': xx, 'y': yy, 'type': 'bar', 'name': 'Vendors', 'marker': {'color': '#9EBC9F'}},
+                                            ],
+                                        }
+                                    ),
+                                )),
+                                dbc.Col(html.Div(
+                                   dcc.Graph(
+                                    id='graph-2',
+                                        figure={
+                                            'data': [
+                                                {'x': xx2, 'y': yy2, 'type': 'bar', 'name': 'Field strength', 'marker': {'color': '#D3B88C'}},
+                                            ],
+                                        }
+                                    ),
+                                )),
+                            ]
+                        ),
+                        dcc.Store(id='crosstab-store', data=crosstab_data(data)),
+                    ],
+                    style={
+                        'marginBottom': 25,
+                        'marginTop': 25,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                    }
+                ),
+                html.Div(
+                    dcc.Input(id='query-1', value='', type='text', debounce=True,
+                        placeholder='Only list studies matching, e.g. mc = Y AND (ss = 4MM OR ss = 6MM)',
+                        style={'width': '40%'}
                     ),
-                    dbc.Row(
-                        [
-                            dbc.Col(html.Div(
-                                dcc.Graph(
-                                    id='graph-1',
-                                    figure={
-                                        'data': [
-                                            {'x': xx, 'y': yy, 'type': 'bar', 'name': 'Vendors', 'marker': {'color': '#9EBC9F'}},
-                                        ],
-                                    }
+                    style={
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                        'textAlign': 'center'
+                    }
+                ),
+                html.Div(
+                    id='table-1',
+                    style={
+                        'marginBottom': 25,
+                        'marginTop': 25,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                    }
+                ),
+                html.Div(
+                    [
+                        dbc.Button("Previous", id='table-1-prev', color="light", size="sm"),
+                        dbc.Button("Next", id='table-1-next', color="light", size="sm", className="ml-2"),
+                    ],
+                    id='table-1-pager',
+                    style={'display': 'none'}
+                ),
+                html.Div(
+                    id='table-1-download',
+                    style={
+                        'marginTop': 10,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                    }
+                ),
+                dcc.Store(id='table-1-page', data={'page': 0}),
+                html.Div(
+                    [
+                        html.H4('Drill down', style={'textAlign': 'center'}),
+                        dbc.Row(
+                            [
+                                dbc.Col(dcc.Dropdown(
+                                    id='drill-path',
+                                    options=plotnames,
+                                    value=drill_path,
+                                    multi=True,
+                                    ),
+                                    width={"size": 8, "offset": 1},
                                 ),
-                            )),
-                            dbc.Col(html.Div(
-                               dcc.Graph(
-                                id='graph-2',
-                                    figure={
-                                        'data': [
-                                            {'x': xx2, 'y': yy2, 'type': 'bar', 'name': 'Field strength', 'marker': {'color': '#D3B88C'}},
-                                        ],
-                                    }
+                                dbc.Col(dcc.RadioItems(
+                                    id='drill-kind',
+                                    options=[{'label': ' Sunburst ', 'value': 'sunburst'},
+                                             {'label': ' Treemap', 'value': 'treemap'}],
+                                    value='sunburst',
+                                    ),
+                                    width=2,
                                 ),
-                            )),
-                        ]
-                    ),
-                ],
-                style={
-                    'marginBottom': 25,
-                    'marginTop': 25,
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                }
-            ),
-            html.Div(
-                id='table-1',
-                style={
-                    'marginBottom': 25,
-                    'marginTop': 25,
-                    'marginLeft': '5%',
-                    'maxWidth': '90%',
-                }
-            )
-])
+                            ]
+                        ),
+                        dcc.Graph(id='drill-graph', figure=drilldown_figure(data, tuple(drill_path), 'sunburst')),
+                    ],
+                    style={
+                        'marginBottom': 25,
+                        'marginTop': 25,
+                        'marginLeft': '5%',
+                        'maxWidth': '90%',
+                    }
+                ),
+    ])
 
 
 # Callback for updating graph 1
@@ -183,8 +247,13 @@ layout = html.Div([
     [Input('drop-1','value')]
 )
 def update_graph(feature):
+    return feature_graph(studies.get(), feature)
 
-    srs = df_plot[feature].value_counts()
+
+@memoize()
+def feature_graph(data, feature):
+
+    srs = data.cube.value_counts(feature)
     xx = srs.index.to_list()
     yy = srs.values
     txt = colnames[feature]
@@ -199,6 +268,7 @@ def update_graph(feature):
 
     return [fig, title]
 
+
 # Callback for updating dropdown2 based on dropdown1 value
 @app.callback(
     [Output('drop-2', 'options'),
@@ -211,81 +281,199 @@ def reset_dropdown2_opts(value):
     return plotnames_2, value_2
 
 
-# Callback for updating graph 2 based on graph1 hoverData and dropdowns
-@app.callback(
-    [Output('graph-2', 'figure'),
-     Output('graph-2-title', 'children')],
-    [Input('graph-1', 'hoverData'),
-     Input('drop-1','value'),
-     Input('drop-2','value')]
-)
-def update_graph(hoverData, feature1, feature2):
+# Graph 2 for the hovered value of feature 1. The browser runs the same
+# logic as visualize.update_graph_2 (assets/clientside.js) on crosstab-store;
+# this server-side version is kept for scripted use and as the reference.
+def update_graph_2(hoverData, feature1, feature2):
     if hoverData is None or feature1 is None or feature2 is None:
         raise PreventUpdate
     else:
         x = hoverData['points'][0]['x']
-        dataframe = df_plot.loc[df_plot[feature1] == x]
-        srs = dataframe[feature2].value_counts()
-        xx = srs.index.to_list()
-        yy = srs.values
-        txt = colnames[feature2] + ' options when ' + colnames[feature1] + ' = ' + x
+        return crosstab_graph(studies.get(), feature1, x, feature2)
+
+
+@memoize()
+def crosstab_graph(data, feature1, x, feature2):
+
+    srs = data.cube.crosstab(feature1, x, feature2)
+    xx = srs.index.to_list()
+    yy = srs.values
+    txt = colnames[feature2] + ' options when ' + colnames[feature1] + ' = ' + x
+
+    fig={
+        'data': [
+            {'x': xx, 'y': yy, 'type': 'bar', 'name': txt, 'marker': {'color': '#D3B88C'}},
+        ],
+    }
+
+    title = txt
 
-        fig={
-            'data': [
-                {'x': xx, 'y': yy, 'type': 'bar', 'name': txt, 'marker': {'color': '#D3B88C'}},
-            ],
-        }
+    return [fig, title]
+
+
+# Keep the browser's copy of the count tables in step with the aggregates,
+# which change as studies are submitted; only sent when they have changed
+@app.callback(
+    Output('crosstab-store', 'data'),
+    [Input('drop-1','value')],
+    [State('crosstab-store', 'data')]
+)
+def update_crosstab_store(feature, store):
+    data = studies.get()
+    if store and store.get('version') == data.version:
+        raise PreventUpdate
+    return crosstab_data(data)
 
-        title = txt
 
-        return [fig, title]
+# Clientside callback for updating graph 2 based on graph1 hoverData and dropdowns
+app.clientside_callback(
+    ClientsideFunction(namespace='visualize', function_name='update_graph_2'),
+    [Output('graph-2', 'figure'),
+     Output('graph-2-title', 'children')],
+    [Input('graph-1', 'hoverData'),
+     Input('drop-1','value'),
+     Input('drop-2','value')],
+    [State('crosstab-store', 'data')]
+)
 
 
-# Callback for showing table 1 after filtering on feature 1
+# Callback for showing table 1 after filtering on feature 1, one page at a time
 @app.callback(
-    Output('table-1', 'children'),
+    [Output('table-1', 'children'),
+     Output('table-1-page', 'data'),
+     Output('table-1-pager', 'style')],
     [Input('graph-1', 'clickData'),
-     Input('drop-1','value')])
-def generate_table(clickData, feature, max_rows=20):
+     Input('drop-1','value'),
+     Input('query-1', 'value'),
+     Input('table-1-prev', 'n_clicks'),
+     Input('table-1-next', 'n_clicks')],
+    [State('table-1-page', 'data')])
+def generate_table(clickData, feature, query_text='', prev_clicks=None, next_clicks=None, page_state=None,
+                   page_size=table_page_size):
 
     if clickData is None:
         raise PreventUpdate
     else:
         x = clickData['points'][0]['x']
+        data = studies.get()
+
+        # Previous/next move through the pages; a new click or feature starts over
+        triggered = [t['prop_id'] for t in dash.callback_context.triggered] if dash.callback_context.triggered else []
+        page = (page_state or {}).get('page', 0)
+        if 'table-1-prev.n_clicks' in triggered:
+            page -= 1
+        elif 'table-1-next.n_clicks' in triggered:
+            page += 1
+        else:
+            page = 0
+        try:
+            rows = selected_rows(data, feature, x, query_text)
+        except query.QueryError as e:
+            message = html.H6('Invalid query: ' + str(e), style={'textAlign': 'center'})
+            return [message, {'page': 0}, {'display': 'none'}]
+        page_count = max(-(-len(rows) // page_size), 1)
+        page = min(max(page, 0), page_count - 1)
+
+        pager_style = {'marginLeft': '5%'} if page_count > 1 else {'display': 'none'}
+        return [studies_table(data, feature, x, query_text, page, page_size), {'page': page}, pager_style]
+
+
+# Links to streamed exports of all the studies listed in table 1
+@app.callback(
+    Output('table-1-download', 'children'),
+    [Input('graph-1', 'clickData'),
+     Input('drop-1','value'),
+     Input('query-1', 'value')])
+def update_download(clickData, feature, query_text=''):
+    if clickData is None:
+        raise PreventUpdate
+    x = clickData['points'][0]['x']
+    links = [html.A(label, href=rest.export_url(fmt, feature=feature, value=x, q=query_text), className='ml-2')
+             for fmt, label in rest.export_formats.items()]
+    return ['Download these studies as'] + links
+
+
+def selected_rows(data, feature, x, query_text=''):
+    # Studies with the clicked value, narrowed down by the query if one is given
+    if not query_text or not query_text.strip():
+        return data.rows(feature, x)
+    return query.rows(data, query.both(query.equals(feature, x), query.parse(data, query_text)))
+
+
+@memoize()
+def studies_table(data, feature, x, query_text='', page=0, page_size=table_page_size):
+
+    # Pull each column out once for the rows on this page, then build the
+    # table rows from those arrays
+    rows = selected_rows(data, feature, x, query_text)
+    page_rows = rows[page * page_size:(page + 1) * page_size]
+    columns = [writeColumn(col, data.column(col, page_rows)) for col in data.df.columns]
+
+    table=html.Table([
+        html.Thead(
+            html.Tr([html.Th(col) for col in list(colnames.values())])
+        ),
+        html.Tbody([
+            html.Tr([html.Td(value) for value in values]) for values in zip(*columns)
+        ]),
+        ],
+        className='qcsummary',
+    )
+
+    # class="table-row" data-href="http://tutorialsplane.com"
+
+    first = page * page_size + 1 if len(page_rows) else 0
+    condition = colnames[feature] + ' = ' + x
+    if query_text and query_text.strip():
+        condition += ' and ' + query_text.strip()
+    heading=html.H4('Showing studies where ' + condition
+                    + ' ({}-{} of {})'.format(first, page * page_size + len(page_rows), len(rows)),
+                    style={'textAlign': 'center',})
+
+    # table = dbc.Table.from_dataframe(dataframe,
+    #                                  striped=True,
+    #                                  bordered=True,
+    #                                  hover=True,
+    #                                  responsive=True,
+    #                                  className='qcsummary'
+    #                                  )
 
-        dataframe = df_plot.loc[df_plot[feature] == x]
-        table=html.Table([
-            html.Thead(
-                html.Tr([html.Th(col) for col in list(colnames.values())])
-            ),
-            html.Tbody([
-                html.Tr([
-                    html.Td(writeElement(i, col, dataframe)) for col in dataframe.columns],
-                ) for i in range(min(len(dataframe), max_rows))
-            ]),
-            ],
-            className='qcsummary',
-        )
-
-        # class="table-row" data-href="http://tutorialsplane.com"
-
-        heading=html.H4('Showing studies where ' + colnames[feature] + ' = ' + x,
-                        style={'textAlign': 'center',})
-
-        # table = dbc.Table.from_dataframe(dataframe,
-        #                                  striped=True,
-        #                                  bordered=True,
-        #                                  hover=True,
-        #                                  responsive=True,
-        #                                  className='qcsummary'
-        #                                  )
-
-        return [heading, table]
-
-
-def writeElement(i, col, dataframe):
+    return [heading, table]
+
+
+def writeColumn(col, values):
     if col == 'doi':
-        hrf = 'https://doi.org/'+dataframe.iloc[i][col]
-        return html.A([dataframe.iloc[i][col]], href=hrf, target="_blank")
+        return [html.A([doi], href='https://doi.org/' + doi, target="_blank") for doi in values]
     else:
-        return dataframe.iloc[i][col]
\ No newline at end of file
+        return values
+
+
+# Callback for the drill-down chart. The whole tree along the chosen path is
+# sent at once, so zooming into a segment happens in the browser
+@app.callback(
+    Output('drill-graph', 'figure'),
+    [Input('drill-path', 'value'),
+     Input('drill-kind', 'value')]
+)
+def update_drilldown(path, kind):
+    if not path:
+        raise PreventUpdate
+    return drilldown_figure(studies.get(), tuple(path), kind)
+
+
+@memoize()
+def drilldown_figure(data, path, kind='sunburst'):
+
+    tree = aggregates.group_tree(data, path)
+    names = [colnames[feature] if feature else '' for feature in tree['feature']]
+
+    fig={
+        'data': [
+            {'type': kind, 'ids': tree['ids'], 'labels': tree['labels'], 'parents': tree['parents'],
+             'values': tree['values'], 'customdata': names, 'branchvalues': 'total', 'maxdepth': 3,
+             'hovertemplate': '%{customdata} = %{label}<br>%{value} studies<extra></extra>'},
+        ],
+        'layout': {'height': 600, 'margin': {'t': 10, 'l': 10, 'r': 10, 'b': 10}},
+    }
+
+    return fig
@@ -6,57 +6,21 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 import pandas as pd
 from app import app
+from datastore import studies, submissions, upload
+import base64
 import urllib.parse
 import json
 
-# Get data
-filename = 'assets/rtfMRI_methods_review_included_studies_procsteps.txt'
-df_studies = pd.read_csv(filename, sep='\t', lineterminator='\r')
-df_studies = df_studies.dropna(axis='columns')
-
-colnames = {
-    'vendor': 'Vendor',
-    'magnet': 'Field strength',
-    'software': 'Software',
-    'stc': 'Slice time correction',
-    'mc': '3D volume realignment',
-    'ss': 'Spatial smoothing',
-    'dr': 'Drift removal',
-    'hmp': 'Realignment parameter regression',
-    'ts': 'Temporal smoothing',
-    'ff': 'Frequency filtering',
-    'or': 'Outlier removal',
-    'droi': 'Differential ROI',
-    'resp': 'Respiratory noise removal',
-}
-
-
-plotnames = [
-    {'label': 'Vendor', 'value': 'vendor'},
-    {'label': 'Field strength', 'value': 'magnet'},
-    {'label': 'Software', 'value': 'software'},
-    {'label': 'Slice time correction', 'value': 'stc'},
-    {'label': '3D volume realignment', 'value': 'mc'},
-    {'label': 'Spatial smoothing', 'value': 'ss'},
-    {'label': 'Drift removal', 'value': 'dr'},
-    {'label': 'Realignment parameter regression', 'value': 'hmp'},
-    {'label': 'Temporal smoothing', 'value': 'ts'},
-    {'label': 'Frequency filtering', 'value': 'ff'},
-    {'label': 'Outlier removal', 'value': 'or'},
-    {'label': 'Differential ROI', 'value': 'droi'},
-    {'label': 'Respiratory noise removal', 'value': 'resp'},
-]
-
-options_df = df_studies.copy()
-df = options_df.drop(columns='author')
-df = df.drop(columns='doi')
-
-input_options = {}
-for key in colnames.keys():
-    srs = df[key].value_counts()
-    xx = srs.index.to_list()
-    yy = srs.values
-    input_options[key] = [{'label': val, 'value': val} for val in xx]
+colnames = {key: studies.colnames[key] for key in studies.features}
+
+# Components used by the callbacks below, by id (see index.validation_layout)
+component_ids = {'author': dbc.Input, 'doi': dbc.Input, 'article-title': dbc.Textarea}
+component_ids.update({key: dcc.Dropdown for key in colnames.keys() if key != 'resp'})
+component_ids.update({'resp': dbc.Checklist, 'submit': dbc.Button, 'show-submit': html.Div,
+                      'upload': dcc.Upload, 'show-upload': html.Div})
+
+# Rejected rows listed on the page after an upload (the endpoint returns all)
+upload_errors_shown = 20
 
 
 heading = html.Div(
@@ -78,8 +42,8 @@ The use of validated text fields, dropdowns and checkboxes makes this process qu
 This section still needs some work. Currently, the entry fields (and their options) below are populated from the [main study data](https://github.com/jsheunis/quality-and-denoising-in-rtfmri-nf).
 This will be updated in future so as to allow a wider variety of input options. 
 
-When you click on the `Submit` button, it will download an admittedly badly formatted `csv`-file containing your input data.
-The goal is to improve this machine-readable output substantially and to automatically add it to this database of studies.
+When you click on the `Submit` button, your input is stored with the other submitted studies and a link appears to download an admittedly badly formatted `csv`-file containing your input data.
+The goal is to improve this machine-readable output substantially.
 Additionally, it will also generate human-readable sentences (containing your entered data) that you can use when writing the methods section of an article.    
 
 ''')
@@ -131,146 +95,205 @@ section1 = dbc.Row(
 )
 
 
-section2 = dbc.Row(
-    [
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label(colnames[value], html_for=value),
-                    dcc.Dropdown(
-                        id=value,
-                        options=input_options[value],
-                    )
-                ]
-            ),
-            width={"size": 3}, # figure out offset
-        ) for value in ['vendor', 'magnet', 'software']
+upload_md = dcc.Markdown('''
 
-    ],
-    justify="start",
-    form=True,
-)
+To submit many studies at once, upload a tab or comma separated file with the columns of the
+[main study data](https://github.com/jsheunis/quality-and-denoising-in-rtfmri-nf): `author`, `vendor`, `magnet`, `software`,
+`stc`, `mc`, `ss`, `dr`, `hmp`, `ts`, `ff`, `or`, `droi`, `resp` and `doi` (and optionally `title`), one study per row.
+Every method must have one of the values offered in the dropdowns above. Rows that pass all checks are stored; the others are listed below with what is wrong.
+Scripts can send the same files to `/api/submissions`.
 
-section3 = dbc.Row(
-    [
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label(colnames[value], html_for=value),
-                    dcc.Dropdown(
-                        id=value,
-                        options=input_options[value],
-                    )
-                ]
-            ),
-            width={"size": 3}, # figure out offset
-        ) for value in ['stc', 'mc', 'ss', 'dr']
+''')
 
-    ],
-    justify="start",
-    form=True,
-)
 
-section4 = dbc.Row(
-    [
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label(colnames[value], html_for=value),
-                    dcc.Dropdown(
-                        id=value,
-                        options=input_options[value],
-                    )
-                ]
+def layout(data):
+    """Submit page, with dropdown options from a StudyData snapshot."""
+    input_options = {key: data.options(key) for key in colnames.keys()}
+
+    section2 = dbc.Row(
+        [
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label(colnames[value], html_for=value),
+                        dcc.Dropdown(
+                            id=value,
+                            options=input_options[value],
+                        )
+                    ]
+                ),
+                width={"size": 3}, # figure out offset
+            ) for value in ['vendor', 'magnet', 'software']
+
+        ],
+        justify="start",
+        form=True,
+    )
+
+    section3 = dbc.Row(
+        [
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label(colnames[value], html_for=value),
+                        dcc.Dropdown(
+                            id=value,
+                            options=input_options[value],
+                        )
+                    ]
+                ),
+                width={"size": 3}, # figure out offset
+            ) for value in ['stc', 'mc', 'ss', 'dr']
+
+        ],
+        justify="start",
+        form=True,
+    )
+
+    section4 = dbc.Row(
+        [
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label(colnames[value], html_for=value),
+                        dcc.Dropdown(
+                            id=value,
+                            options=input_options[value],
+                        )
+                    ]
+                ),
+                width={"size": 3}, # figure out offset
+            ) for value in ['hmp', 'ts', 'ff', 'or']
+
+        ],
+        justify="start",
+        form=True,
+    )
+
+    section5 = dbc.Row(
+        [
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label(colnames['droi'], html_for='droi'),
+                        dcc.Dropdown(
+                            id='droi',
+                            options=input_options['droi'],
+                        )
+                    ]
+                ),
+                width={"size": 3}, # figure out offset
             ),
-            width={"size": 3}, # figure out offset
-        ) for value in ['hmp', 'ts', 'ff', 'or']
-
-    ],
-    justify="start",
-    form=True,
-)
-
-section5 = dbc.Row(
-    [
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label(colnames['droi'], html_for='droi'),
-                    dcc.Dropdown(
-                        id='droi',
-                        options=input_options['droi'],
-                    )
-                ]
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label(colnames['resp'], html_for='resp'),
+                        dbc.Checklist(
+                            id='resp',
+                            options=input_options['resp'],
+                            value=[],
+                        ),
+
+                    ]
+                ),
+                width={"size": 3}, # figure out offset
             ),
-            width={"size": 3}, # figure out offset
-        ),
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label(colnames['resp'], html_for='resp'),
-                    dbc.Checklist(
-                        id='resp',
-                        options=input_options['resp'],
-                        value=[],
-                    ),
 
-                ]
-            ),
-            width={"size": 3}, # figure out offset
+        ],
+        justify="start",
+        form=True,
+    )
+
+
+    return html.Div([
+        html.H2('Submit',
+        style={
+            'textAlign': 'center',
+            'marginBottom': 25,
+            'marginTop': 25,
+        }),
+        main_md,
+        html.Br([]),
+        html.H4(['Study details']),
+        html.Br([]),
+        section1,
+        html.Br([]),
+        html.H4(['Hardware and software']),
+        html.Br([]),
+        section2,
+        html.Br([]),
+        html.H4(['Processing steps']),
+        html.Br([]),
+        section3,
+        section4,
+        section5,
+        html.Br([]),
+        dbc.Button("Submit", id='submit', color="primary"),
+        html.Br([]),
+        html.Div(id='show-submit'),
+        html.Br([]),
+        html.H4(['Upload several studies']),
+        html.Br([]),
+        upload_md,
+        dcc.Upload(
+            id='upload',
+            children=html.Div(['Drag and drop or ', html.A('select a TSV or CSV file')]),
+            max_size=upload.max_upload_bytes,
+            style={
+                'width': '100%',
+                'lineHeight': '60px',
+                'borderWidth': '1px',
+                'borderStyle': 'dashed',
+                'borderRadius': '5px',
+                'textAlign': 'center',
+            },
         ),
-
+        html.Br([]),
+        html.Div(id='show-upload')
     ],
-    justify="start",
-    form=True,
-)
-
-
-layout = html.Div([
-    html.H2('Submit',
     style={
-        'textAlign': 'center',
         'marginBottom': 25,
         'marginTop': 25,
-    }),
-    main_md,
-    html.Br([]),
-    html.H4(['Study details']),
-    html.Br([]),
-    section1,
-    html.Br([]),
-    html.H4(['Hardware and software']),
-    html.Br([]),
-    section2,
-    html.Br([]),
-    html.H4(['Processing steps']),
-    html.Br([]),
-    section3,
-    section4,
-    section5,
-    html.Br([]),
-    dbc.Button("Submit", id='submit', color="primary", href=""),
-    html.Br([]),
-    html.Div(id='show-submit')
-],
-style={
-    'marginBottom': 25,
-    'marginTop': 25,
-    'marginLeft': '5%',
-    'maxWidth': '90%',
-})
-
-
-@app.callback(Output('submit', 'href'),
+        'marginLeft': '5%',
+        'maxWidth': '90%',
+    })
+
+
+@app.callback(Output('show-submit', 'children'),
               [Input('submit', 'n_clicks')],
+              [State('author', 'value'),
+               State('doi', 'value'),
+               State('article-title', 'value')] +
               [State(value, 'value') for value in colnames.keys()])
-def update_output(n_clicks, *selected_vals):
+def update_output(n_clicks, author, doi, title, *selected_vals):
 
-    data = {}
-    for i, key in enumerate(colnames.keys()):
-        data[key] = selected_vals[i]
+    # Only act on actual clicks, not when the page (and button) is rendered
+    if not n_clicks:
+        raise PreventUpdate
 
-    df = pd.DataFrame.from_dict(data)
+    entry = {'author': author, 'doi': doi, 'title': title}
+    for i, key in enumerate(colnames.keys()):
+        entry[key] = selected_vals[i]
+
+    if not any(entry.values()):
+        return "Please fill in the study details and methods before submitting."
+
+    # The checks of batch uploads: required fields, DOI format and not yet
+    # in the dataset or submitted (also catches repeated clicks), known codes
+    form = {key: ' + '.join(value) if isinstance(value, list) else value or '' for key, value in entry.items()}
+    records, errors = upload.validate(pd.DataFrame([form], dtype=str), studies.get())
+    if errors:
+        problems = ["{}: {}".format(studies.colnames.get(error['column'], error['column']), error['message'])
+                    for error in errors]
+        return dbc.Alert(["Please check the form:", html.Ul([html.Li(problem) for problem in problems])],
+                         color="danger")
+
+    data = records[0]
+    submission_id = submissions.add(data)
+    # Show the new study right away in this process (others pick it up within sync_interval)
+    studies.refresh()
+
+    df = pd.DataFrame([{key: submissions.field_value(value) for key, value in data.items()}])
     csv_string = df.to_csv(index=False, encoding='utf-8')
     csv_string = "data:text/csv;charset=utf-8," + urllib.parse.quote(csv_string)
     # file_object = open('rtfmri_methods.txt', 'w')
@@ -278,4 +301,44 @@ def update_output(n_clicks, *selected_vals):
     # json_data = json.dumps(data)
     # json_string = "data:text/html;charset=utf-8," + urllib.parse.quote(json_data)
 
-    return csv_string
+    # A link of its own: the Submit button only submits, so clicking it again
+    # is not mistaken for a download (and rejected as a repeated DOI)
+    return ["Thank you! Your study was stored as submission #{}. ".format(submission_id),
+            html.A("Download it as CSV", href=csv_string, download='rtfmri_submission.csv')]
+
+
+@app.callback(Output('show-upload', 'children'),
+              [Input('upload', 'contents')],
+              [State('upload', 'filename')])
+def upload_studies(contents, filename):
+    if not contents:
+        raise PreventUpdate
+
+    try:
+        result = upload.ingest(base64.b64decode(contents.split(',', 1)[1]), filename or '')
+    except upload.UploadError as e:
+        return dbc.Alert(str(e), color="danger")
+
+    summary = "Stored {} of the {} studies in {}.".format(result['stored'], result['rows'], filename)
+    if not result['errors']:
+        return dbc.Alert(summary, color="success")
+    errors = result['errors'][:upload_errors_shown]
+    table = html.Table([
+        html.Thead(html.Tr([html.Th(name) for name in ('Line', 'Column', 'Value', 'Problem')])),
+        html.Tbody([html.Tr([html.Td(error['line']), html.Td(error['column']), html.Td(error['value']),
+                             html.Td(error['message'])]) for error in errors]),
+    ], className='qcsummary')
+    more = " (the first {} are shown)".format(upload_errors_shown) if len(result['errors']) > upload_errors_shown else ""
+    return [dbc.Alert(summary + " {} problems were found{}:".format(len(result['errors']), more), color="warning"),
+            table]
+
+
+# Refresh the dropdown options from the counts, which every submission updates
+# incrementally (see studies.with_submissions), when the page is shown and
+# after every submission or upload
+@app.callback([Output(value, 'options') for value in colnames.keys()],
+              [Input('show-submit', 'children'),
+               Input('show-upload', 'children')])
+def update_options(show_submit, show_upload=None):
+    data = studies.get()
+    return [data.options(value) for value in colnames.keys()]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import pytest
+from datastore import submissions
+from helpers import study, study_data
+
+
+@pytest.fixture
+def data():
+    """A small StudyData snapshot of five studies."""
+    return study_data([
+        study('Smith et al. (2015)', '10.1000/a1', vendor='Siemens', mc='Y', ss='4MM', resp='RETROICOR'),
+        study('Jones et al. (2016)', '10.1000/b2', vendor='Philips', mc='Y', ss='6MM', **{'or': 'Y'}),
+        study('Brown et al. (2017)', '10.1000/c3 ', vendor='GE', mc='N', ss='4MM', **{'or': 'KALMAN'}),
+        study('Wang and Lee (2018)', '10.1000/d4', vendor='Siemens', mc='N', ss='8MM', resp='RETROICOR + RVHR'),
+        study('Doe (2019)', '10.1000/e5', resp='RVHR'),
+    ])
+
+
+@pytest.fixture(autouse=True)
+def submissions_db(tmp_path, monkeypatch):
+    """An empty submissions database per test."""
+    monkeypatch.setattr(submissions, 'db_path', str(tmp_path / 'submissions.db'))
+    yield submissions.db_path
+    submissions.close()
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Small study tables for the tests."""
+import pandas as pd
+from datastore import studies
+
+
+def study(author, doi, **codes):
+    """One study as a {column: value} row, 'DNR' in the coded columns not given."""
+    row = {feature: 'DNR' for feature in studies.features}
+    row.update(codes, author=author, doi=doi)
+    return row
+
+
+def study_data(rows, version='test'):
+    """StudyData snapshot of `study` rows."""
+    return studies.StudyData(studies.encode(pd.DataFrame(rows, columns=list(studies.colnames))), version=version)
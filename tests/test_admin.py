@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import flask
+import pytest
+from api import admin
+
+
+@pytest.fixture
+def app():
+    app = flask.Flask(__name__)
+    blueprint = flask.Blueprint('guarded', __name__)
+    blueprint.before_request(admin.check_access)
+    blueprint.route('/guarded')(lambda: 'ok')
+    app.register_blueprint(blueprint)
+    return app
+
+
+def status(app, headers=None, remote_addr='127.0.0.1'):
+    return app.test_client().get('/guarded', headers=headers or {},
+                                 environ_overrides={'REMOTE_ADDR': remote_addr}).status_code
+
+
+def test_without_token_only_local_debug_requests(app, monkeypatch):
+    monkeypatch.setattr(admin, 'admin_token', None)
+    assert status(app) == 403
+    app.debug = True
+    assert status(app) == 200
+    assert status(app, remote_addr='10.0.0.5') == 403
+    # Through a reverse proxy on the same host
+    assert status(app, {'X-Forwarded-For': '203.0.113.9'}) == 403
+    assert status(app, {'Forwarded': 'for=203.0.113.9'}) == 403
+
+
+def test_token(app, monkeypatch):
+    monkeypatch.setattr(admin, 'admin_token', 's3cret')
+    assert status(app) == 403
+    assert status(app, {'X-Admin-Token': 'wrong'}) == 403
+    assert status(app, {'X-Admin-Token': 's3cret'}, remote_addr='10.0.0.5') == 200
+    assert status(app, {'Authorization': 'Bearer s3cret'}, remote_addr='10.0.0.5') == 200
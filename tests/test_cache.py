@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import pandas as pd
+import pytest
+from datastore import cache
+
+
+@pytest.fixture
+def parsed(tmp_path, monkeypatch):
+    """A parser that records the paths it parsed, with the cache under tmp_path."""
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path / 'cache'))
+    calls = []
+
+    def parse(path):
+        calls.append(path)
+        with open(path) as f:
+            return pd.DataFrame({'author': f.read().split()})
+    return parse, calls
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def test_unchanged_file_is_loaded_from_the_cache(tmp_path, parsed):
+    parse, calls = parsed
+    source = write(tmp_path / 'studies.txt', 'Smith Jones')
+    df, digest = cache.load(source, parse, 'v1')
+    again, same = cache.load(source, parse, 'v1')
+    assert len(calls) == 1
+    assert same == digest
+    assert list(again['author']) == ['Smith', 'Jones']
+
+
+def test_changed_file_is_parsed_again(tmp_path, parsed):
+    parse, calls = parsed
+    source = write(tmp_path / 'studies.txt', 'Smith Jones')
+    _, digest = cache.load(source, parse, 'v1')
+    write(tmp_path / 'studies.txt', 'Smith Jones Brown')
+    df, changed = cache.load(source, parse, 'v1')
+    assert len(calls) == 2
+    assert changed != digest
+    assert list(df['author']) == ['Smith', 'Jones', 'Brown']
+
+
+def test_touched_file_is_not_parsed_again(tmp_path, parsed):
+    parse, calls = parsed
+    source = write(tmp_path / 'studies.txt', 'Smith Jones')
+    cache.load(source, parse, 'v1')
+    stat = os.stat(source)
+    os.utime(source, (stat.st_atime, stat.st_mtime + 10))
+    cache.load(source, parse, 'v1')
+    assert len(calls) == 1
+    assert cache.validate(source, 'v1') is not None
+
+
+def test_new_schema_is_parsed_again(tmp_path, parsed):
+    parse, calls = parsed
+    source = write(tmp_path / 'studies.txt', 'Smith Jones')
+    cache.load(source, parse, 'v1')
+    assert cache.validate(source, 'v2') is None
+    cache.load(source, parse, 'v2')
+    assert len(calls) == 2
+    assert cache.validate(source, 'v2') is not None
+
+
+def test_files_with_the_same_name_have_their_own_cache(tmp_path, parsed):
+    parse, calls = parsed
+    first = write(tmp_path / 'a' / 'studies.txt', 'Smith')
+    second = write(tmp_path / 'b' / 'studies.txt', 'Jones')
+    assert cache.cache_paths(first) != cache.cache_paths(second)
+    assert list(cache.load(first, parse, 'v1')[0]['author']) == ['Smith']
+    assert list(cache.load(second, parse, 'v1')[0]['author']) == ['Jones']
+    assert list(cache.load(first, parse, 'v1')[0]['author']) == ['Smith']
+    assert len(calls) == 2
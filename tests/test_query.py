@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import pytest
+from datastore import query
+
+
+def authors(data, text):
+    return [data.df['author'].iat[i].split()[0] for i in query.rows(data, text)]
+
+
+def test_condition(data):
+    assert query.parse(data, 'vendor = Siemens') == ('eq', 'vendor', 'Siemens')
+    assert authors(data, 'vendor = siemens') == ['Smith', 'Wang']
+
+
+def test_feature_names(data):
+    assert query.parse(data, 'Spatial smoothing = 4MM') == ('eq', 'ss', '4MM')
+
+
+def test_and_binds_tighter_than_or(data):
+    assert query.parse(data, 'vendor = GE OR mc = Y AND ss = 4MM') == \
+        ('or', ('eq', 'vendor', 'GE'), ('and', ('eq', 'mc', 'Y'), ('eq', 'ss', '4MM')))
+    assert authors(data, 'vendor = GE OR mc = Y AND ss = 4MM') == ['Smith', 'Brown']
+    assert authors(data, '(vendor = GE OR mc = Y) AND ss = 4MM') == ['Smith', 'Brown']
+    assert authors(data, '(vendor = GE OR mc = Y) AND ss = 6MM') == ['Jones']
+
+
+def test_not(data):
+    assert query.parse(data, 'NOT mc = Y AND ss = 4MM') == ('and', ('not', ('eq', 'mc', 'Y')), ('eq', 'ss', '4MM'))
+    assert authors(data, 'not (mc = Y or vendor = GE)') == ['Wang', 'Doe']
+
+
+def test_not_equal(data):
+    assert query.parse(data, 'vendor != Siemens') == ('not', ('eq', 'vendor', 'Siemens'))
+    assert authors(data, 'vendor!=Siemens') == ['Jones', 'Brown', 'Doe']
+
+
+def test_values_with_spaces_and_quotes(data):
+    assert authors(data, 'resp = RETROICOR + RVHR') == ['Wang']
+    assert query.parse(data, 'resp = "RETROICOR + RVHR" AND mc = N') == \
+        ('and', ('eq', 'resp', 'RETROICOR + RVHR'), ('eq', 'mc', 'N'))
+    assert query.parse(data, "vendor = 'O\\'Neil AND co'") == ('eq', 'vendor', "O'Neil AND co")
+    assert authors(data, 'vendor = "Siemens" AND ss = \'8MM\'') == ['Wang']
+
+
+def test_or_column_key(data):
+    assert query.parse(data, 'or = Y') == ('eq', 'or', 'Y')
+    assert authors(data, 'or != DNR') == ['Jones', 'Brown']
+    assert authors(data, 'mc = Y AND or = Y') == ['Jones']
+    assert authors(data, 'vendor = Siemens OR or = KALMAN') == ['Smith', 'Brown', 'Wang']
+    assert authors(data, 'NOT or = DNR AND (or = KALMAN)') == ['Brown']
+
+
+def test_unknown_value_matches_nothing(data):
+    assert authors(data, 'vendor = Toshiba') == []
+
+
+@pytest.mark.parametrize('text, message', [
+    ('colour = red', 'Unknown feature'),
+    ('vendor Siemens', 'Unknown feature'),
+    ('vendor = ', 'Expected a feature or value'),
+    ('vendor = GE OR', 'Expected a feature or value'),
+    ('(vendor = GE', 'Unexpected end of query'),
+    ('vendor = GE)', r"Unexpected '\)'"),
+    ('mc < Y', 'Unknown feature'),
+    ('vendor = "GE', "Unexpected '\"'"),
+])
+def test_errors(data, text, message):
+    with pytest.raises(query.QueryError, match=message):
+        query.parse(data, text)
+
+
+def test_is_query():
+    assert query.is_query('mc=Y')
+    assert not query.is_query('Smith')
+    assert not query.is_query('')
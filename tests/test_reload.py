@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from datastore import studies
+from helpers import study, study_data
+
+
+@pytest.fixture
+def watched(tmp_path, monkeypatch):
+    """A watched study file, and the snapshots `load` returned, newest last."""
+    path = tmp_path / 'studies.txt'
+    path.write_text('v1')
+    loaded = []
+
+    def load(path=None):
+        stamps = studies._stamps()
+        data = study_data([study('Smith (2015)', '10.1000/a')], version='v{}'.format(len(loaded)))
+        data.stamps = stamps
+        loaded.append(data)
+        return data
+
+    monkeypatch.setattr(studies, 'filename', str(path))
+    monkeypatch.setattr(studies, 'reload_trigger', str(tmp_path / 'reload-request'))
+    monkeypatch.setattr(studies, 'load', load)
+    monkeypatch.setattr(studies, 'watch_interval', 0.02)
+    monkeypatch.setattr(studies, '_watcher_pid', None)
+    monkeypatch.setattr(studies, '_data', load())
+    yield path, loaded
+    studies.stop_watcher()
+
+
+def wait(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_snapshot_loaded_before_a_change_is_reloaded(watched):
+    # As in a worker forked from a master that loaded the previous file
+    path, loaded = watched
+    path.write_text('version 2')
+    studies.start_watcher()
+    assert wait(lambda: len(loaded) == 2)
+    assert studies.get() is loaded[-1]
+
+
+def test_unchanged_file_is_not_reloaded(watched):
+    path, loaded = watched
+    studies.start_watcher()
+    time.sleep(0.2)
+    assert len(loaded) == 1
+
+
+def test_request_reload_reloads_once(watched):
+    path, loaded = watched
+    studies.start_watcher()
+    studies.request_reload()
+    time.sleep(0.2)
+    assert len(loaded) == 2
+    assert studies.get() is loaded[-1]
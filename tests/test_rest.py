@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import flask
+import pytest
+from api import rest
+from datastore import studies
+from helpers import study, study_data
+
+
+@pytest.fixture
+def client(data, monkeypatch):
+    monkeypatch.setattr(studies, '_data', data)
+    monkeypatch.setattr(studies, 'watch_interval', 0)
+    monkeypatch.setattr(studies, '_watcher_pid', None)
+    app = flask.Flask(__name__)
+    app.register_blueprint(rest.blueprint)
+    return app.test_client()
+
+
+def test_unchanged_response_is_not_sent_again(client):
+    first = client.get('/api/counts')
+    assert first.status_code == 200
+    assert first.headers['ETag']
+    again = client.get('/api/counts', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_etag_depends_on_parameters_and_version(client, monkeypatch):
+    etag = client.get('/api/counts').headers['ETag']
+    assert client.get('/api/counts?fields=vendor').headers['ETag'] != etag
+    assert client.get('/api/counts?format=csv').headers['ETag'] != etag
+    assert client.get('/api/studies').headers['ETag'] != etag
+
+    monkeypatch.setattr(studies, '_data', study_data([study('Smith et al. (2015)', '10.1000/a1')], version='v2'))
+    changed = client.get('/api/counts', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert json.loads(changed.data)['counts']['vendor'] == {'DNR': 1}
+
+
+def test_gzipped_response_has_its_own_etag(client):
+    plain = client.get('/api/studies')
+    zipped = client.get('/api/studies', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert client.get('/api/studies', headers={'Accept-Encoding': 'gzip',
+                                               'If-None-Match': plain.headers['ETag']}).status_code == 200
+    assert client.get('/api/studies', headers={'Accept-Encoding': 'gzip',
+                                               'If-None-Match': zipped.headers['ETag']}).status_code == 304
+
+
+def test_studies_are_streamed(client, monkeypatch):
+    monkeypatch.setattr(rest, 'export_chunk_rows', 2)
+    response = client.get('/api/studies?fields=author,vendor&q=vendor=Siemens OR vendor=GE')
+    assert response.is_streamed
+    body = json.loads(response.data)
+    assert body['count'] == 3
+    assert [row['author'] for row in body['studies']] == ['Smith et al. (2015)', 'Brown et al. (2017)',
+                                                         'Wang and Lee (2018)']
+    csv = client.get('/api/studies?fields=author&search=rvhr&format=csv').data.decode()
+    assert csv.splitlines() == ['author', 'Wang and Lee (2018)', 'Doe (2019)']
+
+
+def test_invalid_requests(client):
+    assert client.get('/api/studies?q=vendor ==').status_code == 400
+    assert client.get('/api/counts?fields=nope').status_code == 400
+    assert client.get('/api/counts?format=xml').status_code == 400
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from datastore import studies
+from datastore.search import SearchIndex
+
+
+def scan(df, term):
+    """The search the index replaces: a substring scan of every column."""
+    mask = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        mask |= df[col].astype(str).str.contains(term, case=False, regex=False).values
+    return mask
+
+
+@pytest.fixture(scope='module')
+def curated():
+    return studies.read_studies(studies.filename)
+
+
+terms = ['', 'a', 'SIEMENS', 'siem', 'mens', 'ge', '3t', '1.5', 'tbv', 'dnr', 'y', 'n',
+         '10.', '10.1016', '/j.', 'et al', 'et al.', ' (20', '2019)', '(', ')', ' ',
+         'retroicor', 'RETROICOR + RVHR', 'x', 'zzz', 'weiskopf', 'WEI', 'kopf', 'é']
+
+
+@pytest.mark.parametrize('term', terms)
+def test_same_rows_as_a_scan(curated, term):
+    index = SearchIndex(curated)
+    assert (index.lookup(term) == scan(curated, term)).all()
+
+
+def test_same_rows_as_a_scan_on_the_fixture(data):
+    for term in ['smith', 'ITH', 'wang and', 'c3 ', '10.1000/', 'RVHR', 'kalman', '6mm', 'philips']:
+        assert (data.search(term) == scan(data.df, term)).all(), term
+
+
+def test_terms_as_long_as_and_shorter_than_an_ngram(data):
+    index = SearchIndex(data.df, n=3)
+    for term in ['s', 'sm', 'smi', 'smit', 'h e', 'e5']:
+        assert (index.lookup(term) == scan(data.df, term)).all(), term
+
+
+def test_none_matches_nothing(data):
+    assert not data.search(None).any()
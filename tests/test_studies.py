@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+from datastore import query, studies, submissions, tablequery
+from helpers import study, study_data
+
+
+def rebuilt(data):
+    # The same studies in one freshly indexed snapshot
+    submitted = studies.fill_missing(submissions.read_frame(), data.base.df.columns)
+    return study_data(pd.concat([data.base.df.astype(object), submitted.astype(object)]).to_dict('records'),
+                      version='rebuilt-' + data.version)
+
+
+def assert_same(data, expected):
+    assert len(data) == len(expected)
+    for col in expected.df.columns:
+        assert list(data.column(col)) == list(expected.column(col))
+    for feature in expected.coded:
+        assert data.cube.value_counts(feature).to_dict() == expected.cube.value_counts(feature).to_dict()
+        for value in expected.labels(feature):
+            assert list(data.rows(feature, value)) == list(expected.rows(feature, value))
+            for other in ('vendor', 'mc'):
+                assert data.cube.crosstab(feature, value, other).to_dict() == \
+                    expected.cube.crosstab(feature, value, other).to_dict()
+    for term in ('et al', 'new', '10.2000', 'siemens', 'toshiba', 'x'):
+        assert list(data.search(term)) == list(expected.search(term))
+    for text in ('vendor = Toshiba', 'mc = Y AND NOT vendor = Siemens', 'ss = 4MM OR or = KALMAN'):
+        assert list(query.rows(data, text)) == list(query.rows(expected, text))
+    for col in ('author', 'doi', 'vendor'):
+        for direction in ('asc', 'desc'):
+            sort_by = [{'column_id': col, 'direction': direction}]
+            rows = np.arange(len(data))
+            assert list(tablequery.sort_rows(data, rows, sort_by)) == list(tablequery.sort_rows(expected, rows, sort_by))
+    rows = np.arange(len(data))[::-1]
+    assert data.records(rows) == expected.records(rows)
+
+
+def test_without_submissions(data):
+    assert studies.with_submissions(data) is data
+
+
+def test_submissions_are_added(data):
+    before = data.cube.value_counts('vendor').to_dict()
+    submissions.add_many([study('New et al. (2020)', '10.2000/a', vendor='GE', mc='Y'),
+                          study('Alpha (2021)', '10.2000/b', vendor='Toshiba', ss='4MM')])
+    merged = studies.with_submissions(data)
+    assert merged.version == 'test-2'
+    assert merged.cube.value_counts('vendor').to_dict() == {'Siemens': 2, 'GE': 2, 'DNR': 1, 'Philips': 1,
+                                                             'Toshiba': 1}
+    assert_same(merged, rebuilt(merged))
+    # The curated snapshot is shared, not changed
+    assert data.cube.value_counts('vendor').to_dict() == before
+    assert len(data) == 5
+
+
+def test_changes_are_applied_incrementally(data):
+    ids = submissions.add_many([study('New et al. (2020)', '10.2000/a', vendor='GE'),
+                                study('Alpha (2021)', '10.2000/b', vendor='Toshiba')])
+    first = studies.with_submissions(data)
+    ids.append(submissions.add(study('Zulu (2022)', '10.2000/c', vendor='Siemens', mc='Y')))
+    submissions.delete(ids[1])
+    second = studies.with_submissions(first)
+    assert second.base is data
+    assert second.version == 'test-4'
+    assert 'Toshiba' not in second.cube.value_counts('vendor')
+    assert_same(second, rebuilt(second))
+    assert studies.with_submissions(second) is second
+    submissions.delete(ids[0])
+    submissions.delete(ids[2])
+    assert_same(studies.with_submissions(second), data)
+
+
+@pytest.mark.parametrize('values, more', [
+    (['b', 'd', 'b', 'f'], ['a', 'd', 'c', 'g', 'e', 'c', 'cc']),
+    (['b'], []),
+    (['x', 'y'], ['y', 'x']),
+])
+def test_merge_ranks(values, more):
+    ranks = np.unique(values, return_inverse=True)[1]
+    keys = studies.merge_ranks(ranks, np.array(values, dtype=object), np.array(more, dtype=object))
+    combined = values + more
+    assert [combined[i] for i in np.argsort(keys, kind='stable')] == sorted(combined)
+    assert all((keys[i] == keys[j]) == (combined[i] == combined[j])
+               for i in range(len(combined)) for j in range(len(combined)))
+
+
+def test_refresh_without_submissions_included(data, monkeypatch):
+    monkeypatch.setattr(studies, '_data', data)
+    monkeypatch.setattr(studies, 'watch_interval', 0)
+    submissions.add(study('New et al. (2020)', '10.2000/a', vendor='GE'))
+    monkeypatch.setattr(studies, 'include_submissions', False)
+    assert studies.refresh() is data
+    monkeypatch.setattr(studies, 'include_submissions', True)
+    assert len(studies.refresh()) == 6
+
+
+def test_existing_dois(data):
+    assert data.existing_dois(['10.1000/a1', '10.1000/c3', '10.1000/zz']) == {'10.1000/a1', '10.1000/c3'}
+    submissions.add(study('New et al. (2020)', '10.2000/New'))
+    merged = studies.with_submissions(data)
+    assert merged.existing_dois(['10.2000/new', '10.1000/b2', '10.2000/x']) == {'10.2000/new', '10.1000/b2'}
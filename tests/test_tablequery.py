@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from datastore import tablequery
+
+
+def authors(data, mask):
+    return [data.df['author'].iat[i].split()[0] for i in np.flatnonzero(mask)]
+
+
+@pytest.mark.parametrize('part, expected', [
+    ('{vendor} = Siemens', ('vendor', '=', 'Siemens')),
+    ('{vendor} eq "Siemens"', ('vendor', '=', 'Siemens')),
+    ('{mc} != Y', ('mc', '!=', 'Y')),
+    ('{mc} ne Y', ('mc', '!=', 'Y')),
+    ('{author} contains Smith', ('author', 'contains', 'Smith')),
+    ('{author} contains "et al"', ('author', 'contains', 'et al')),
+    ('{author} contains \'O\\\'Neil\'', ('author', 'contains', "O'Neil")),
+    ('{author} >= B', ('author', '>=', 'B')),
+    ('{author} < B', ('author', '<', 'B')),
+    ('{or} = KALMAN', ('or', '=', 'KALMAN')),
+    ('{author} containsSmith', (None, None, None)),
+    ('vendor = Siemens', (None, None, None)),
+    ('{vendor} ~ Siemens', (None, None, None)),
+])
+def test_split_filter_part(part, expected):
+    assert tablequery.split_filter_part(part) == expected
+
+
+def test_filter_mask(data):
+    assert authors(data, tablequery.filter_mask(data, '{vendor} = Siemens && {mc} != Y')) == ['Wang']
+    assert authors(data, tablequery.filter_mask(data, '{author} contains et al')) == ['Smith', 'Jones', 'Brown']
+    assert authors(data, tablequery.filter_mask(data, '{or} = KALMAN')) == ['Brown']
+    assert authors(data, tablequery.filter_mask(data, '{author} >= S')) == ['Smith', 'Wang']
+
+
+def test_filter_mask_ignores_unknown_columns(data):
+    assert tablequery.filter_mask(data, '{colour} = red').all()
+    assert tablequery.filter_mask(data, '').all()
+
+
+def test_filter_mask_restricts_mask(data):
+    mask = np.array([True, False, True, True, True])
+    assert authors(data, tablequery.filter_mask(data, '{ss} = 4MM', mask)) == ['Smith', 'Brown']
+
+
+def test_search_mask(data):
+    assert authors(data, tablequery.search_mask(data, 'vendor = Siemens AND ss = 8MM')) == ['Wang']
+    assert authors(data, tablequery.search_mask(data, 'jones')) == ['Jones']
+    # Not a valid query: searched for as a term
+    assert authors(data, tablequery.search_mask(data, 'colour = red')) == []
+
+
+def sorted_like_pandas(data, rows, sort_by):
+    # The sort the ranks replace: a stable sort of the values themselves
+    frame = data.df.reset_index(drop=True).iloc[rows].astype(str)
+    frame = frame.sort_values([col['column_id'] for col in sort_by],
+                              ascending=[col['direction'] == 'asc' for col in sort_by], kind='mergesort')
+    return list(frame.index)
+
+
+@pytest.mark.parametrize('sort_by', [
+    [{'column_id': 'author', 'direction': 'asc'}],
+    [{'column_id': 'author', 'direction': 'desc'}],
+    [{'column_id': 'vendor', 'direction': 'asc'}],
+    [{'column_id': 'vendor', 'direction': 'desc'}, {'column_id': 'doi', 'direction': 'asc'}],
+    [{'column_id': 'resp', 'direction': 'asc'}, {'column_id': 'mc', 'direction': 'desc'},
+     {'column_id': 'author', 'direction': 'desc'}],
+])
+def test_sort_rows(data, sort_by):
+    rows = np.arange(len(data))
+    assert list(tablequery.sort_rows(data, rows, sort_by)) == sorted_like_pandas(data, rows, sort_by)
+    subset = np.array([0, 2, 3, 4])
+    assert list(tablequery.sort_rows(data, subset, sort_by)) == sorted_like_pandas(data, subset, sort_by)
+
+
+def test_sort_rows_keeps_order_without_sort_by(data):
+    rows = np.array([3, 1, 4])
+    assert list(tablequery.sort_rows(data, rows, [])) == [3, 1, 4]
+    assert list(tablequery.sort_rows(data, rows, None)) == [3, 1, 4]
+
+
+def test_page():
+    rows = np.arange(45)
+    shown, count = tablequery.page(rows, 0, 20)
+    assert list(shown) == list(range(20)) and count == 3
+    assert list(tablequery.page(rows, 2, 20)[0]) == list(range(40, 45))
+    # Past the end (e.g. after a filter removed rows): the last page
+    assert list(tablequery.page(rows, 7, 20)[0]) == list(range(40, 45))
+    assert list(tablequery.page(rows, None, 20)[0]) == list(range(20))
+    shown, count = tablequery.page(rows[:0], 3, 20)
+    assert len(shown) == 0 and count == 1
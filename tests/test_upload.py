@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import io
+import flask
+import pandas as pd
+import pytest
+from api import uploads
+from datastore import studies, submissions, upload
+from helpers import study
+
+
+def table(*rows):
+    return pd.DataFrame(list(rows), columns=list(studies.colnames)).astype(str)
+
+
+def tsv(df):
+    return df.to_csv(sep='\t', index=False).encode('utf-8')
+
+
+def problems(errors):
+    return [(error['line'], error['column'], error['message']) for error in errors]
+
+
+def test_valid_rows(data):
+    records, errors = upload.validate(table(
+        study(' New et al. (2020) ', '10.2000/new ', vendor='siemens', mc='y', resp='rvhr + retroicor'),
+    ), data)
+    assert errors == []
+    record, = records
+    assert (record['author'], record['doi']) == ('New et al. (2020)', '10.2000/new')
+    assert (record['vendor'], record['mc'], record['resp']) == ('Siemens', 'Y', 'RVHR + RETROICOR')
+
+
+def test_required(data):
+    records, errors = upload.validate(table(study('', ''), study('New', '10.2000/x', mc='')), data)
+    assert records == []
+    assert problems(errors) == [(2, 'author', 'required'), (2, 'doi', 'required'), (3, 'mc', 'required')]
+
+
+def test_doi_format(data):
+    _, errors = upload.validate(table(study('New', 'doi:10.2000/x'), study('New', '10.20/x')), data)
+    assert problems(errors) == [(2, 'doi', 'not a DOI (10.xxxx/...)'), (3, 'doi', 'not a DOI (10.xxxx/...)')]
+
+
+def test_doi_already_in_the_dataset(data):
+    # The third curated study's DOI ends with a space
+    _, errors = upload.validate(table(study('New', '10.1000/A1'), study('New', '10.1000/c3')), data)
+    assert problems(errors) == [(2, 'doi', 'already in the dataset'), (3, 'doi', 'already in the dataset')]
+
+
+def test_doi_already_submitted(data):
+    submissions.add({'author': 'Earlier', 'doi': ' 10.2000/Sub '})
+    records, errors = upload.validate(table(study('New', '10.2000/sub'), study('New', '10.2000/other')), data)
+    assert problems(errors) == [(2, 'doi', 'already in the dataset')]
+    assert [record['doi'] for record in records] == ['10.2000/other']
+
+
+def test_doi_repeated_in_the_file(data):
+    records, errors = upload.validate(table(study('New', '10.2000/x'), study('New', '10.2000/X')), data)
+    assert problems(errors) == [(3, 'doi', 'repeated in the file')]
+    assert len(records) == 1
+
+
+def test_vocabulary(data):
+    _, errors = upload.validate(table(
+        study('New', '10.2000/x', vendor='Toshiba'),
+        study('New', '10.2000/y', resp='RETROICOR + NOPE'),
+        study('New', '10.2000/z', mc='Y + N'),
+    ), data)
+    assert problems(errors) == [(2, 'vendor', 'not one of the allowed values'),
+                                (3, 'resp', 'not one of the allowed values'),
+                                (4, 'mc', 'not one of the allowed values')]
+
+
+def test_ingest_stores_valid_rows(data):
+    result = upload.ingest(tsv(table(study('New', '10.2000/x'), study('', '10.2000/y'))), 'new.tsv', data)
+    assert (result['rows'], result['stored']) == (2, 1)
+    assert submissions.existing_dois(['10.2000/X', '10.2000/y']) == {'10.2000/x'}
+
+
+def test_read_table_csv_with_cr_line_ends(data):
+    content = table(study('New', '10.2000/x')).to_csv(index=False).replace('\n', '\r').encode('utf-8')
+    df = upload.read_table(content, 'new.csv')
+    assert list(df['doi']) == ['10.2000/x']
+
+
+def test_read_table_rejects(data, monkeypatch):
+    with pytest.raises(upload.UploadError, match='Missing columns: vendor'):
+        upload.read_table(tsv(table(study('New', '10.2000/x')).drop(columns='vendor')))
+    with pytest.raises(upload.UploadError, match='not UTF-8'):
+        upload.read_table(b'author\t\xff\n')
+    monkeypatch.setattr(upload, 'max_upload_rows', 1)
+    with pytest.raises(upload.UploadError, match='at most 1'):
+        upload.read_table(tsv(table(study('New', '10.2000/x'), study('New', '10.2000/y'))))
+    monkeypatch.setattr(upload, 'max_upload_bytes', 10)
+    with pytest.raises(upload.UploadError, match='larger than'):
+        upload.read_table(tsv(table(study('New', '10.2000/x'))))
+
+
+@pytest.fixture
+def client(data, monkeypatch):
+    monkeypatch.setattr(studies, '_data', data)
+    monkeypatch.setattr(studies, 'watch_interval', 0)
+    monkeypatch.setattr(studies, '_watcher_pid', None)
+    app = flask.Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+    app.register_blueprint(uploads.blueprint)
+    return app.test_client()
+
+
+def test_upload_form_file(client):
+    content = tsv(table(study('New', '10.2000/x'), study('New', '10.1000/a1')))
+    response = client.post('/api/submissions', data={'file': (io.BytesIO(content), 'new.tsv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['rows'], result['stored']) == (2, 1)
+    assert problems(result['errors']) == [(3, 'doi', 'already in the dataset')]
+    # Stored and shown right away
+    assert len(studies.get()) == 6
+    assert studies.get().existing_dois(['10.2000/x']) == {'10.2000/x'}
+
+
+def test_upload_request_body(client):
+    response = client.post('/api/submissions', data=tsv(table(study('New', '10.2000/x'))),
+                           content_type='text/tab-separated-values')
+    assert response.get_json()['stored'] == 1
+
+
+def test_upload_rejected(client):
+    response = client.post('/api/submissions', data=b'author\tdoi\n', content_type='text/plain')
+    assert response.status_code == 400
+    assert 'Missing columns' in response.get_json()['error']
+    response = client.post('/api/submissions', data=b'x' * (1024 * 1024 + 1), content_type='text/plain')
+    assert response.status_code == 413
+    assert len(studies.get()) == 5